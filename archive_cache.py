@@ -0,0 +1,18 @@
+# use this to see how much the archive cache in --cachepath saved
+from pathlib import Path
+from config import Config
+from util.archivecache import ArchiveCache
+
+config = Config(Path("config.txt"))
+if config.cache_path is None:
+    print("No --cachepath in config.txt")
+    exit(1)
+report = ArchiveCache.report(config.cache_path)
+print("Archive cache", config.cache_path)
+print("Archives", report["archives"], "size", report["cached_bytes"])
+print("Limit", config.cache_size or "unlimited")
+print(
+    "Hits", report["hits"], "misses", report["misses"], f"({report['hit_ratio']:.1%})"
+)
+print("Bytes not downloaded again", report["hit_bytes"])
+print("Evictions", report["evictions"], "reclaimed bytes", report["reclaimed_bytes"])
@@ -0,0 +1,290 @@
+# use this to measure the hot loops of the patcher on your own disks, run with -h for the benchmarks
+import os
+import tracemalloc
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import md5
+from io import StringIO
+from json import dumps
+from os import urandom
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
+
+from game.gameutil import CompactManifest, Entry_pkg_version, UpdateFile
+from rich.console import Console
+from rich.progress import Progress
+from util.batchedprogress import BatchedProgress
+from util.bruhcopy import BruhCopy
+from util.bruhzipfile import BruhZipFile
+from util.patchprocesser import PatchProcesser
+
+MIB = 1024 * 1024
+
+
+def timed(threads: int, job: Callable[[int], None]):
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        start = perf_counter()
+        list(executor.map(job, range(threads)))
+        return perf_counter() - start
+
+
+def report(name: str, what: str, size: int, seconds: float):
+    print(f"{name:>16} {what:>8} {size / MIB / seconds:10.1f} MiB/s {seconds:8.3f}s")
+
+
+def make_file(file: Path, size: int):
+    # random, so a compressing filesystem doesn't make it look faster
+    block = urandom(MIB)
+    with file.open("wb") as f:
+        for _ in range(size // MIB):
+            f.write(block)
+
+
+def bench_progress(work_path: Path, size: int, threads: int, rounds: int):
+    with TemporaryDirectory(dir=work_path) as temp:
+        temp = Path(temp)
+        files = [temp / f"verify{index}.bin" for index in range(threads)]
+        for file in files:
+            make_file(file, size)
+        md5s = [md5(file.read_bytes()).hexdigest() for file in files]
+        archive = temp / "extract.zip"
+        member = files[0].read_bytes()[: 4 * MIB]
+        with ZipFile(archive, "w", ZIP_STORED) as zf:
+            for index in range(size // len(member)):
+                zf.writestr(f"member{index}.bin", member)
+            archive_size = sum(zi.file_size for zi in zf.infolist())
+        print(
+            f"{threads} threads, {size // MIB} MiB per thread, best of {rounds} rounds"
+        )
+        for name, factory in (
+            ("Progress", Progress),
+            ("BatchedProgress", BatchedProgress),
+        ):
+            # nothing is drawn, only the bookkeeping of the hot loops is measured
+            progress = factory(console=Console(file=StringIO()))
+            task = progress.add_task("bench", total=None)
+
+            def verify(index: int):
+                PatchProcesser._verify_file(
+                    files[index], md5s[index], size, progress, task
+                )
+
+            def extract(index: int):
+                with BruhZipFile(
+                    archive, lambda _, step: progress.advance(task, step)
+                ) as zf:
+                    zf.extractall(temp / f"extract{index}")
+
+            seconds = min(timed(threads, verify) for _ in range(rounds))
+            report(name, "verify", size * threads, seconds)
+            seconds = min(timed(threads, extract) for _ in range(rounds))
+            report(name, "extract", archive_size * threads, seconds)
+            progress.stop()
+
+
+def evict(file: Path):
+    # a cold read of the archive, like the first one after downloading it to another disk
+    if hasattr(os, "posix_fadvise"):
+        with file.open("rb") as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def bench_order(work_path: Path, size: int, members: int, rounds: int):
+    with TemporaryDirectory(dir=work_path) as temp:
+        temp = Path(temp)
+        archive = temp / "order.zip"
+        block = urandom(size // members)
+        with ZipFile(archive, "w", ZIP_DEFLATED, compresslevel=1) as zf:
+            for index in range(members):
+                # incompressible blocks like the game's, with a few compressible ones in between
+                zf.writestr(
+                    f"member{index}.bin",
+                    block if index % 8 else bytes(len(block)),
+                    ZIP_STORED if index % 2 else ZIP_DEFLATED,
+                )
+            infolist = zf.infolist()
+        # the order members came out of a set before the read planner
+        scattered = sorted(infolist, key=lambda info: hash(info.filename))
+        print(
+            f"{members} members, {size // MIB} MiB, best of {rounds} rounds, page cache {'dropped' if hasattr(os, 'posix_fadvise') else 'kept'} before each"
+        )
+        for name, order, read_ahead in (
+            ("hash order", scattered, 0),
+            (
+                "offset order",
+                [info for _, info in PatchProcesser.plan_reads(infolist)],
+                0,
+            ),
+            (
+                "offset+ahead",
+                [info for _, info in PatchProcesser.plan_reads(infolist)],
+                16 * MIB,
+            ),
+        ):
+
+            def extract(_: int):
+                evict(archive)
+                with BruhZipFile(archive, lambda *_: None, None, read_ahead) as zf:
+                    for info in order:
+                        zf.extract(info, temp / "out")
+
+            seconds = min(timed(1, extract) for _ in range(rounds))
+            report(name, "extract", size, seconds)
+
+
+def legacy_manifest(raw: bytes, infolist: list[ZipInfo]):
+    # how UpdateFile kept pkg_version and split the members before CompactManifest
+    pkg_version = {
+        Entry_pkg_version.from_json(line.strip())
+        for line in raw.decode().splitlines()
+        if line
+    }
+    inpkgfiles = {entry.remoteName for entry in pkg_version}
+    inpkg = {info for info in infolist if Path(info.filename) in inpkgfiles}
+    standalone = {info for info in infolist if not info.is_dir() and info not in inpkg}
+    return raw, pkg_version, inpkgfiles, inpkg, standalone
+
+
+def compact_manifest(raw: bytes, infolist: list[ZipInfo]):
+    pkg_version = CompactManifest(raw)
+    in_manifest = pkg_version.lookup([info.filename for info in infolist])
+    inpkg = UpdateFile.get_inpkgfiles_info(infolist, in_manifest)
+    standalone = UpdateFile.get_standalonefiles_info(infolist, in_manifest, [])
+    return pkg_version, inpkg, standalone
+
+
+def bench_manifest(entries: int, rounds: int):
+    names = [
+        f"GenshinImpact_Data/StreamingAssets/AssetBundles/blocks/{i % 256:02X}/{i:08d}.blk"
+        for i in range(entries)
+    ]
+    raw = "\r\n".join(
+        dumps(
+            {
+                "remoteName": name,
+                "md5": md5(name.encode()).hexdigest(),
+                "fileSize": len(name) * 1024,
+            }
+        )
+        for name in names
+    ).encode()
+    # a tenth of the members are standalone files that aren't in the manifest
+    infolist = [ZipInfo(name) for name in names] + [
+        ZipInfo(f"{name}.standalone") for name in names[::10]
+    ]
+    print(
+        f"{entries} manifest entries, {len(infolist)} members, best of {rounds} rounds"
+    )
+    for name, build in (
+        ("sets", legacy_manifest),
+        ("CompactManifest", compact_manifest),
+    ):
+        seconds = min(timed(1, lambda _: build(raw, infolist)) for _ in range(rounds))
+        tracemalloc.start()
+        kept = build(raw, infolist)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del kept
+        print(
+            f"{name:>16} {seconds:8.3f}s retained {retained / MIB:8.2f} MiB peak {peak / MIB:8.2f} MiB"
+        )
+
+
+def bench_copy(work_path: Path, to_path: Path, size: int, files: int, rounds: int):
+    with TemporaryDirectory(dir=work_path) as temp, TemporaryDirectory(
+        dir=to_path
+    ) as to:
+        temp, to = Path(temp), Path(to)
+        sources = [temp / f"copy{index}.bin" for index in range(files)]
+        for file in sources:
+            make_file(file, size // files)
+        cross_device = temp.stat().st_dev != to.stat().st_dev
+        print(
+            f"{files} files, {size // MIB} MiB, best of {rounds} rounds, {'across devices' if cross_device else 'on one device'}"
+        )
+        # the moves of the patched files and of the audio assets, each copy mode on its own
+        for name, kernel_copiers in (
+            ("buffered", ()),
+            ("sendfile", ("sendfile",)),
+            ("copy_file_range", ("copy_file_range",)),
+        ):
+
+            def copy(_: int):
+                for file in sources:
+                    BruhCopy(lambda *_: None, kernel_copiers).bruh_copy(
+                        file, to / file.name, None
+                    )
+
+            seconds = min(timed(1, copy) for _ in range(rounds))
+            report(name, "copy", size, seconds)
+
+        def commit(_: int):
+            for file in sources:
+                moved = BruhCopy(lambda *_: None).bruh_commit(
+                    file, to / file.name, None
+                )
+                # back for the next round, the same way
+                BruhCopy(lambda *_: None).bruh_commit(moved, file, None)
+
+        seconds = min(timed(1, commit) for _ in range(rounds))
+        # there and back again
+        report("commit", "move", 2 * size, seconds)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog="benchmark", description="Benchmarks of gsp.")
+    parser.add_argument(
+        "-w",
+        "--workpath",
+        type=Path,
+        default=Path("."),
+        help="Directory on the disk to measure, the test files are removed afterwards.",
+    )
+    parser.add_argument(
+        "-r", "--rounds", type=int, default=3, help="Best of these rounds is reported."
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    progress_parser = subparsers.add_parser(
+        "progress",
+        help="Verify and extract throughput with Progress against BatchedProgress.",
+    )
+    progress_parser.add_argument("-s", "--size", type=int, default=256, help="MiB.")
+    progress_parser.add_argument("-t", "--threads", type=int, default=4)
+    manifest_parser = subparsers.add_parser(
+        "manifest",
+        help="Memory and build time of pkg_version and the member split, sets against CompactManifest.",
+    )
+    manifest_parser.add_argument("-e", "--entries", type=int, default=60000)
+    order_parser = subparsers.add_parser(
+        "order",
+        help="Extract throughput of members in hash order against the read planner's offset order with read ahead. Point --workpath at the HDD.",
+    )
+    order_parser.add_argument("-s", "--size", type=int, default=1024, help="MiB.")
+    order_parser.add_argument("-m", "--members", type=int, default=2000)
+    copy_parser = subparsers.add_parser(
+        "copy",
+        help="Throughput of the buffered copy against sendfile and copy_file_range, and of committing patched files. Point --to at another disk for cross device moves.",
+    )
+    copy_parser.add_argument(
+        "--to", type=Path, default=None, help="Defaults to --workpath."
+    )
+    copy_parser.add_argument("-s", "--size", type=int, default=1024, help="MiB.")
+    copy_parser.add_argument("-f", "--files", type=int, default=8)
+    args = parser.parse_args()
+    if args.benchmark == "progress":
+        bench_progress(args.workpath, args.size * MIB, args.threads, args.rounds)
+    elif args.benchmark == "manifest":
+        bench_manifest(args.entries, args.rounds)
+    elif args.benchmark == "order":
+        bench_order(args.workpath, args.size * MIB, args.members, args.rounds)
+    elif args.benchmark == "copy":
+        bench_copy(
+            args.workpath,
+            args.to or args.workpath,
+            args.size * MIB,
+            args.files,
+            args.rounds,
+        )
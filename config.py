@@ -47,7 +47,7 @@ class Config:
             "--logpath",
             type=dir_path,
             default=".",
-            help="Stores current state of patching for resuming purposes. (Not implemented, currently won't do anything)",
+            help="Stores current state of patching for resuming purposes. An interrupted patch skips the files it already finished when run again.",
         )
         self._parser.add_argument(
             "-z",
@@ -77,6 +77,146 @@ class Config:
             required=False,
             help="Force update to only predownload's version.",
         )
+        self._parser.add_argument(
+            "-s",
+            "--segments",
+            type=int,
+            default=1,
+            help="Number of connections used at the same time to download a single archive, each fetching its own byte range.",
+        )
+        self._parser.add_argument(
+            "-cd",
+            "--concurrentdownloads",
+            type=int,
+            default=1,
+            help="Number of archives downloaded at the same time. Each archive is queued for patching as soon as it finishes.",
+        )
+        self._parser.add_argument(
+            "-bw",
+            "--bandwidth",
+            type=int,
+            default=0,
+            help="Total download bandwidth cap in KiB/s shared by all downloads. 0 means unlimited. Can be changed while running with a 'network=' line in gsp_ratelimits.txt in the logpath.",
+        )
+        self._parser.add_argument(
+            "-aw",
+            "--archivewritelimit",
+            type=int,
+            default=0,
+            help="Cap in KiB/s for writing downloaded archives to the patchpath. 0 means unlimited. Can be changed while running with an 'archivewrite=' line in gsp_ratelimits.txt in the logpath.",
+        )
+        self._parser.add_argument(
+            "-pi",
+            "--patchiolimit",
+            type=int,
+            default=0,
+            help="Cap in KiB/s for extracting, copying and verifying game files while patching. 0 means unlimited. Can be changed while running with a 'patchio=' line in gsp_ratelimits.txt in the logpath.",
+        )
+        self._parser.add_argument(
+            "-ro",
+            "--rangeonly",
+            action="store_true",
+            required=False,
+            help="Read the update archives' central directory remotely and only download the members that aren't already identical in the game into a sparse local copy, instead of the whole archive.",
+        )
+        self._parser.add_argument(
+            "-h1",
+            "--http1",
+            action="store_true",
+            required=False,
+            help="Use HTTP/1.1 connections instead of multiplexing requests over HTTP/2. Use this when the CDN caps the speed per connection and --segments should get their own connections.",
+        )
+        self._parser.add_argument(
+            "-ic",
+            "--incremental",
+            action="store_true",
+            required=False,
+            help="Skip the inpkg files and hdiff patches whose files in the game already are the new version, comparing sizes and md5s kept in the logpath for files whose size and modification time didn't change.",
+        )
+        self._parser.add_argument(
+            "-pw",
+            "--patchworkers",
+            type=int,
+            default=1,
+            help="Number of hpatchz processes patching hdiff files at the same time.",
+        )
+        self._parser.add_argument(
+            "-pb",
+            "--patchbudget",
+            type=int,
+            default=2048,
+            help="MiB of temppath that the extracted hdiff files and the files patched from them may take at once with --patchworkers. A file bigger than this is patched alone. 0 doesn't limit it.",
+        )
+        self._parser.add_argument(
+            "-ra",
+            "--readahead",
+            type=int,
+            default=16,
+            help="MiB read ahead from an update archive at once. 0 reads in small pieces.",
+        )
+        self._parser.add_argument(
+            "-ao",
+            "--archiveorder",
+            action="store_true",
+            required=False,
+            help="Extract and patch the members of an update archive in one pass in the order they are stored, instead of extracting everything before patching, so a rotational disk reads the archive front to back. Only without extract workers.",
+        )
+        self._parser.add_argument(
+            "-ew",
+            "--extractworkers",
+            type=int,
+            default=1,
+            help="Number of threads extracting the standalone and inpkg files of an archive at the same time, each reading through its own handle. More help on SSDs, keep 1 for an HDD.",
+        )
+        self._parser.add_argument(
+            "-vw",
+            "--verifyworkers",
+            type=int,
+            default=1,
+            help="Number of threads hashing the game files at the same time when verifying, the biggest files first and taking turns between disks. A single reader leaves an NVMe mostly idle, keep 1 for an HDD.",
+        )
+        self._parser.add_argument(
+            "-rb",
+            "--readback",
+            action="store_true",
+            required=False,
+            help="Verify every file by reading it back after patching, instead of trusting the md5 taken while a file was extracted or patched.",
+        )
+        self._parser.add_argument(
+            "-sf",
+            "--scattered",
+            action="store_true",
+            required=False,
+            help="Install or update the game file by file from the scattered files CDN, checking each file against pkg_version and only downloading those that differ, instead of using the update archives.",
+        )
+        self._parser.add_argument(
+            "-sc",
+            "--scatteredconcurrency",
+            type=int,
+            default=32,
+            help="Number of scattered files downloaded at the same time with --scattered.",
+        )
+        self._parser.add_argument(
+            "-cp",
+            "--cachepath",
+            type=dir_path,
+            required=False,
+            help="Path to a directory shared by several installs and runs that keeps downloaded archives by md5. A cached archive is hardlinked, reflinked or copied into the patchpath instead of downloaded again. Run archive_cache.py for its hits, misses and reclaimed bytes.",
+        )
+        self._parser.add_argument(
+            "-cs",
+            "--cachesize",
+            type=int,
+            default=0,
+            help="Size limit of the cachepath in MiB, the least recently used archives are evicted above it. 0 means unlimited.",
+        )
+        self._parser.add_argument(
+            "-of",
+            "--offline",
+            action="store_true",
+            required=False,
+            help="Don't ask the mhy api, plan the update or installation from the complete archives already in the patchpath, recognised by their names and central directories. Not with --scattered, which needs the api for the scattered files CDN.",
+        )
         self._parser.add_argument(
             "-la",
             "--language",
@@ -98,6 +238,9 @@ class Config:
                     if not line.startswith("#")
                 )
             )
+        if self._args.offline and self._args.scattered:
+            # the archives in the patchpath don't tell where the scattered files are
+            self._parser.error("--offline can't be used with --scattered")
         self.game_path = Path(self._args.gamepath)
         self.temp_path = Path(self._args.temppath)
         self.patch_path = Path(self._args.patchpath)
@@ -109,6 +252,28 @@ class Config:
             self._args.apifile.close()
         self.download_only: bool = self._args.downloadonly
         self.predownload_only: bool = self._args.predownloadonly
+        self.segments: int = self._args.segments
+        self.concurrent_downloads: int = self._args.concurrentdownloads
+        self.bandwidth: int = self._args.bandwidth * 1024
+        self.archive_write_limit: int = self._args.archivewritelimit * 1024
+        self.patch_io_limit: int = self._args.patchiolimit * 1024
+        self.range_only: bool = self._args.rangeonly
+        self.http2: bool = not self._args.http1
+        self.offline: bool = self._args.offline
+        self.incremental: bool = self._args.incremental
+        self.extract_workers: int = self._args.extractworkers
+        self.read_ahead: int = self._args.readahead * 1024 * 1024
+        self.archive_order: bool = self._args.archiveorder
+        self.patch_workers: int = self._args.patchworkers
+        self.patch_budget: int = self._args.patchbudget * 1024 * 1024
+        self.verify_workers: int = self._args.verifyworkers
+        self.verify_on_write: bool = not self._args.readback
+        self.scattered: bool = self._args.scattered
+        self.scattered_concurrency: int = self._args.scatteredconcurrency
+        self.cache_path: Optional[Path] = (
+            Path(self._args.cachepath) if self._args.cachepath else None
+        )
+        self.cache_size: int = self._args.cachesize * 1024 * 1024
         self.languages: Optional[set[GameLanguage]] = (
             {GameLanguage.get(arg) for arg in self._args.language}
             if self._args
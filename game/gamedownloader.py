@@ -1,19 +1,28 @@
+import re
 from io import StringIO
+from json import dumps, loads
 from os.path import basename
 from pathlib import Path
 from queue import Queue
 from sys import getsizeof
+from threading import Lock
+from time import time
 from types import SimpleNamespace
 from typing import Mapping, Optional, cast
 
 from config import Config
 from game.gameinfo import GameInfo
+from game.gamescanner import GameScanner
 from game.gamelanguage import GameLanguage
 from game.gameutil import DownloadFile, UpdateFile
-from httpx import get
+from httpx import Client, HTTPError, codes
 from rich.progress import Progress, TaskID
 from setuptools._vendor.packaging import version as semver
+from util.archivecache import ArchiveCache
+from util.downloadscheduler import DownloadScheduler
+from util.httpclient import ClientManager
 from util.logger import LOGGER
+from util.ratelimiter import RATE_LIMITS, IOClass
 
 
 class GameDownloader:
@@ -33,7 +42,22 @@ class GameDownloader:
         self.path = config.patch_path
         self.config = config
         self.gameinfo = gameinfo
-        self.api_result = config.api_str if config.api_str else self.get_api_result()
+        # one pool for the api and every archive, so connections are kept alive between them
+        self.clients = ClientManager(
+            max(config.concurrent_downloads * config.segments, 1) + 1, config.http2
+        )
+        if config.api_str:
+            self.api_result = config.api_str
+        elif config.offline:
+            self.api_result = GameScanner.scan(
+                config.patch_path,
+                self.gameinfo.version if self.gameinfo else None,
+                self.gameinfo.langs if self.gameinfo else (config.languages or ()),
+            )
+        else:
+            self.api_result = self.get_api_result(
+                self.clients.client, config.log_path / "gsp_api_cache.json"
+            )
         (
             latest_version,
             (self.game_downloads, self.lang_downloads),
@@ -58,14 +82,75 @@ class GameDownloader:
             self.get_download_game_update_bytes() if self.gameinfo else None
         )
         self.download_bytes = self.get_download_full_game_bytes()
+        self.scheduler: Optional[DownloadScheduler] = None
+        self.cache = (
+            ArchiveCache(config.cache_path, config.cache_size)
+            if config.cache_path is not None
+            else None
+        )
         LOGGER.verbose("Init GameDownloader: version %s", self.version)
 
     @staticmethod
-    def get_api_result():
+    def get_api_result(client: Client, cache_file: Optional[Path] = None):
+        cached = GameDownloader.read_api_cache(cache_file) if cache_file else None
+        if cached is not None and cached["expires"] > time():
+            LOGGER.info(
+                "Using cached mhy api result %s, fresh for %ds",
+                cache_file,
+                cached["expires"] - time(),
+            )
+            return cached["result"]
+        headers = {}
+        # the api answers 304 without a body when the cached result is still current
+        if cached is not None and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached is not None and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
         LOGGER.info(
-            "GETting latest game information from mhy api %s", GameDownloader.MHY_API
+            "GETting latest game information from mhy api %s, revalidating %s",
+            GameDownloader.MHY_API,
+            headers,
         )
-        return get(GameDownloader.MHY_API).json()
+        try:
+            response = client.get(GameDownloader.MHY_API, headers=headers)
+            if response.status_code != codes.NOT_MODIFIED:
+                response.raise_for_status()
+        except HTTPError as e:
+            if cached is None:
+                raise
+            LOGGER.warning("Mhy api is unreachable (%s), using cached result", e)
+            return cached["result"]
+        if response.status_code == codes.NOT_MODIFIED and cached is not None:
+            LOGGER.info("Cached mhy api result %s is still current", cache_file)
+            result = cached["result"]
+        else:
+            result = response.json()
+        if cache_file is not None:
+            max_age = re.search(
+                r"max-age=(\d+)", response.headers.get("Cache-Control", "")
+            )
+            temp = cache_file.with_name(f"{cache_file.name}.tmp")
+            temp.write_text(
+                dumps(
+                    {
+                        "etag": response.headers.get("ETag", cached and cached["etag"]),
+                        "last_modified": response.headers.get(
+                            "Last-Modified", cached and cached["last_modified"]
+                        ),
+                        "expires": time() + (int(max_age[1]) if max_age else 0),
+                        "result": result,
+                    }
+                )
+            )
+            temp.replace(cache_file)
+        return result
+
+    @staticmethod
+    def read_api_cache(cache_file: Path) -> Optional[dict]:
+        try:
+            return loads(cache_file.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
 
     @staticmethod
     def read_api_result(
@@ -79,14 +164,16 @@ class GameDownloader:
         game_download = game["latest"]
         lang_download = game_download["voice_packs"]
         version = semver.Version(game_download["version"])
-        game_downloads: list[tuple[str, int]] = [
-            (seg["path"], int(seg["package_size"])) for seg in game_download["segments"]
+        game_downloads: list[tuple[str, int, Optional[str]]] = [
+            (seg["path"], int(seg["package_size"]), seg.get("md5"))
+            for seg in game_download["segments"]
         ]
-        lang_downloads: list[tuple[GameLanguage, str, int]] = [
+        lang_downloads: list[tuple[GameLanguage, str, int, Optional[str]]] = [
             (
                 GameLanguage.get_bycode(lang["language"]),
                 lang["path"],
                 int(lang["package_size"]),
+                lang.get("md5"),
             )
             for lang in lang_download
         ]
@@ -115,14 +202,19 @@ class GameDownloader:
                 # the version will be the pre_download_game's one and not the current anymore
                 version = semver.Version(predl_game["latest"]["version"])
             lang_update = game_update["voice_packs"]
-            game_updates: list[tuple[str, int]] = [
-                (game_update["path"], int(game_update["package_size"]))
+            game_updates: list[tuple[str, int, Optional[str]]] = [
+                (
+                    game_update["path"],
+                    int(game_update["package_size"]),
+                    game_update.get("md5"),
+                )
             ]
-            lang_updates: list[tuple[GameLanguage, str, int]] = [
+            lang_updates: list[tuple[GameLanguage, str, int, Optional[str]]] = [
                 (
                     GameLanguage.get_bycode(lang["language"]),
                     lang["path"],
                     int(lang["package_size"]),
+                    lang.get("md5"),
                 )
                 for lang in lang_update
             ]
@@ -172,8 +264,10 @@ class GameDownloader:
             self.gameinfo.langs,
         )
         self._reset_progress(self.update_bytes)
+        self.scheduler = DownloadScheduler(self.config.concurrent_downloads)
         self._download_game_only_update()
         self._download_lang_update()
+        self.scheduler.join()
         self._finishing_download_tasks()
 
     def _download_game_only_update(self):
@@ -181,6 +275,7 @@ class GameDownloader:
         assert self.game_updates is not None
         assert len(self.game_updates) == 1
         assert self.update_bytes is not None
+        assert self.scheduler is not None
         game_update = self.game_updates[0]
         LOGGER.verbose(
             "Downloading %s update file from %s api size %d %d",
@@ -196,11 +291,11 @@ class GameDownloader:
             description="Downloading",
             lang=GameLanguage.GAME,
         )
-        self._queue_for_patch(
-            cast(
-                UpdateFile,
-                self._download_file((GameLanguage.GAME, *game_update)),
-            )
+        self.scheduler.submit(
+            lambda: cast(
+                UpdateFile, self._download_file((GameLanguage.GAME, *game_update))
+            ),
+            self._queue_for_patch,
         )
 
     def _download_lang_update(self):
@@ -209,6 +304,7 @@ class GameDownloader:
         assert len(self.lang_updates) > 0
         assert self.gameinfo is not None
         assert self.update_bytes is not None
+        assert self.scheduler is not None
         for lang in self.lang_updates:
             if lang[0] not in self.gameinfo.langs:
                 continue
@@ -219,14 +315,12 @@ class GameDownloader:
                 lang[2],
                 self.update_bytes[1][lang[0]],
             )
-            self.progress.reset(
-                self._get_taskid(lang[0]),
-                total=self.update_bytes[1][lang[0]],
-                kolor="blue",
-                description="Downloading",
-                lang=lang[0],
+            self.scheduler.submit(
+                lambda lang=lang, total=self.update_bytes[1][lang[0]]: (
+                    self._download_archive(lang, total)
+                ),
+                self._queue_for_patch,
             )
-            self._queue_for_patch(cast(UpdateFile, self._download_file(lang)))
 
     def download_full_game(self):
         # make sure game is not installed, and the user require download full game (by specifying languages in the config)
@@ -239,11 +333,14 @@ class GameDownloader:
             self.config.languages,
         )
         self._reset_progress(self.download_bytes)
+        self.scheduler = DownloadScheduler(self.config.concurrent_downloads)
         self._download_game_only()
         self._download_lang()
+        self.scheduler.join()
         self._finishing_download_tasks()
 
     def _download_game_only(self):
+        assert self.scheduler is not None
         # currently only do split game downloads because the single download is unstable
         is_split = len(self.game_downloads) > 1
         LOGGER.info(
@@ -261,27 +358,48 @@ class GameDownloader:
             description="Downloading",
             lang=GameLanguage.GAME,
         )
-        downloaded_files = [
-            self._download_file(
-                (None if is_split else GameLanguage.GAME, link, size), GameLanguage.GAME
+        # a split archive is only complete once all of its parts are, whichever finishes last queues it
+        downloaded_files: list[UpdateFile | Path | SimpleNamespace | None] = [
+            None
+        ] * len(self.game_downloads)
+        remaining = [len(self.game_downloads)]
+        lock = Lock()
+
+        def part_downloaded(
+            index: int, downloaded_file: UpdateFile | Path | SimpleNamespace
+        ):
+            with lock:
+                downloaded_files[index] = downloaded_file
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            LOGGER.trace("Collected full game archive file(s) %s", downloaded_files)
+            # manually creates UpdateFile if the downloads result in more than one file, in which case _download_file returns a Path instead
+            # if the download file is forcefully excluded in config, it skips downloading and return a fake NameSpace that contains 'lang' to satisfy the minimum requirement
+            self._queue_for_patch(
+                downloaded_files[0]
+                if isinstance(downloaded_files[0], (UpdateFile | SimpleNamespace))
+                else UpdateFile(
+                    cast(list[Path], downloaded_files), GameLanguage.GAME, self.version
+                )
             )
-            for link, size in self.game_downloads
-        ]
-        LOGGER.trace("Collected full game archive file(s) %s", downloaded_files)
-        # manually creates UpdateFile if the downloads result in more than one file, in which case _download_file returns a Path instead
-        # if the download file is forcefully excluded in config, it skips downloading and return a fake NameSpace that contains 'lang' to satisfy the minimum requirement
-        self._queue_for_patch(
-            downloaded_files[0]
-            if isinstance(downloaded_files[0], (UpdateFile | SimpleNamespace))
-            else UpdateFile(
-                cast(list[Path], downloaded_files), GameLanguage.GAME, self.version
+
+        for index, (link, size, md5) in enumerate(self.game_downloads):
+            self.scheduler.submit(
+                lambda link=link, size=size, md5=md5: self._download_file(
+                    (None if is_split else GameLanguage.GAME, link, size, md5),
+                    GameLanguage.GAME,
+                ),
+                lambda downloaded_file, index=index: part_downloaded(
+                    index, downloaded_file
+                ),
             )
-        )
 
     def _download_lang(self):
         # user must allow at least one lang update
         assert self.config.languages is not None
         assert len(self.config.languages) > 0
+        assert self.scheduler is not None
         for lang in self.lang_downloads:
             if lang[0] not in self.config.languages:
                 continue
@@ -292,18 +410,29 @@ class GameDownloader:
                 lang[2],
                 self.download_bytes[1][lang[0]],
             )
-            self.progress.reset(
-                self._get_taskid(lang[0]),
-                total=self.download_bytes[1][lang[0]],
-                kolor="blue",
-                description="Downloading",
-                lang=lang[0],
+            self.scheduler.submit(
+                lambda lang=lang: self._download_archive(
+                    lang, self.download_bytes[1][lang[0]]
+                ),
+                self._queue_for_patch,
             )
-            self._queue_for_patch(cast(UpdateFile, self._download_file(lang)))
+
+    def _download_archive(
+        self, segment: tuple[GameLanguage, str, int, Optional[str]], total: int
+    ) -> UpdateFile | SimpleNamespace:
+        # the progress only turns into downloading once a scheduler worker picks the archive up
+        self.progress.reset(
+            self._get_taskid(segment[0]),
+            total=total,
+            kolor="blue",
+            description="Downloading",
+            lang=segment[0],
+        )
+        return cast(UpdateFile | SimpleNamespace, self._download_file(segment))
 
     def _download_file(
         self,
-        segment: tuple[Optional[GameLanguage], str, int],
+        segment: tuple[Optional[GameLanguage], str, int, Optional[str]],
         opt_lang: GameLanguage = GameLanguage.GAME,
     ) -> UpdateFile | Path | SimpleNamespace:
         file_path = self.path / basename(segment[1])
@@ -328,7 +457,7 @@ class GameDownloader:
             segment[1],
             segment[2],
         )
-        return DownloadFile(
+        download_file = DownloadFile(
             segment[1],
             file_path,
             segment[2],
@@ -336,7 +465,33 @@ class GameDownloader:
             lambda step: self.progress.advance(true_task_id, step),
             # if don't provide a language it returns a Path
             segment[0],
-        ).download()
+            self.config.segments,
+            self._throttle,
+            # only update archives are worth reading remotely, a fresh install needs every member
+            (
+                self.gameinfo.path
+                if self.config.range_only and self.gameinfo is not None
+                else None
+            ),
+            segment[3],
+        )
+        if (
+            self.cache is not None
+            and not download_file.is_complete()
+            and self.cache.fetch(segment[1], segment[3], segment[2], file_path)
+        ):
+            download_file.replaced()
+        downloaded = download_file.download(self.clients.client)
+        # a sparse copy of range mode isn't the archive, only complete and verified ones are shared
+        if self.cache is not None and download_file.is_complete():
+            self.cache.store(segment[1], segment[3], file_path)
+        return downloaded
+
+    @staticmethod
+    def _throttle(step: int):
+        # shared by every concurrent download so the caps are for the whole link and disk
+        RATE_LIMITS.consume(IOClass.NETWORK, step)
+        RATE_LIMITS.consume(IOClass.ARCHIVE_WRITE, step)
 
     def _queue_for_patch(self, update_file: UpdateFile | SimpleNamespace):
         # preinstallation
@@ -400,6 +555,7 @@ class GameDownloader:
             )
 
     def _finishing_download_tasks(self):
+        self.clients.close()
         sentinel = (None, None)
         LOGGER.notice(
             "All download tasks finished, sending sentinel %s to the patch queue %s",
@@ -420,13 +576,22 @@ class GameDownloader:
 
     @staticmethod
     def _get_download_bytes(
-        game: list[tuple[str, int]], langs: list[tuple[GameLanguage, str, int]]
+        game: list[tuple[str, int, Optional[str]]],
+        langs: list[tuple[GameLanguage, str, int, Optional[str]]],
     ) -> tuple[int, dict[GameLanguage, int]]:
-        return sum(size for _, size in game), {lang[0]: lang[2] for lang in langs}
+        return sum(size for _, size, _ in game), {lang[0]: lang[2] for lang in langs}
 
     def get_deprecated_bytes(self, from_where: Path):
         return sum(getsizeof(str(from_where / file)) for file in self.deprecated_files)
 
+    @staticmethod
+    def get_decompressed_path(api_result: dict, version: semver.Version) -> str:
+        predl_game = api_result["data"]["pre_download_game"]
+        # the scattered files of a predownload version live under the predownload's path
+        if predl_game is not None and predl_game["latest"]["version"] == str(version):
+            return predl_game["latest"]["decompressed_path"]
+        return api_result["data"]["game"]["latest"]["decompressed_path"]
+
     @staticmethod
     def get_this_version_config_ini(new_ver: semver.Version):
         parser = GameInfo.create_new_config(new_ver)
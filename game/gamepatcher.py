@@ -1,3 +1,4 @@
+from pathlib import Path
 from queue import Queue
 from threading import Thread
 from types import SimpleNamespace
@@ -8,9 +9,14 @@ from game.gamedownloader import GameDownloader
 from game.gameinfo import GameInfo
 from game.gamelanguage import GameLanguage
 from game.gameutil import AudioAsset, UpdateFile
+from game.scattereddownloader import ScatteredDownloader
 from rich.progress import Progress, TaskID
+from util.bruhhpatchz import HPatchZSupervisor
 from util.logger import LOGGER
+from util.md5cache import Md5Cache
+from util.patchjournal import PatchJournal
 from util.patchprocesser import PatchProcesser
+from util.writeverifier import WriteVerifier
 
 
 class GamePatcher:
@@ -39,13 +45,74 @@ class GamePatcher:
             config, gameinfo, progress, game_task, langs_task, self.patch_queue
         )
         self.downloader_thread = None
+        # md5 of the installed files, so an incremental run doesn't hash unchanged files again
+        self.md5_cache = (
+            Md5Cache(config.log_path / "gsp_md5_cache.json")
+            if config.incremental
+            else None
+        )
 
     def patch(self, download_full_game: bool):
-        if download_full_game:
+        if self.config.scattered:
+            self._scattered()
+        elif download_full_game:
             self._extract()
         else:
             self._patch()
 
+    def _scattered(self):
+        other = SimpleNamespace(name="OTHER")
+        if self.gameinfo is not None:
+            self._ready(other)
+        game_path = (
+            self.gameinfo.path if self.gameinfo is not None else self.config.game_path
+        )
+        langs = (
+            self.gameinfo.langs
+            if self.gameinfo is not None
+            else (self.config.languages or set())
+        )
+        downloader = ScatteredDownloader(
+            GameDownloader.get_decompressed_path(
+                self.downloader.api_result, self.downloader.version[1]
+            ),
+            game_path,
+            self.config.scattered_concurrency,
+            self.config.http2,
+            self.md5_cache,
+        )
+        for lang in (GameLanguage.GAME, *langs):
+            task_id = self.taskids[lang]
+            downloader.download(
+                lang,
+                lambda total: self.progress.reset(
+                    task_id,
+                    total=total,
+                    description="Scattered",
+                    kolor="blue",
+                    lang=lang,
+                ),
+                lambda step: self.progress.advance(task_id, step),
+            )
+            self.progress.update(
+                task_id, description="Patched", kolor="purple", lang=lang
+            )
+            if self.md5_cache is not None:
+                self.md5_cache.save()
+        self.downloader.clients.close()
+        finishing_task = self.progress.add_task(
+            description="Concluding",
+            total=None,
+            kolor="wheat4",
+            lang=other,
+        )
+        PatchProcesser.step_write_config_ini(
+            game_path,
+            self.downloader.new_config_ini_text,
+            self.downloader.version[1],
+        )
+        self.progress.remove_task(finishing_task)
+
     def _extract(self):
         self.downloader_thread = Thread(
             target=self.downloader.download_full_game,
@@ -73,28 +140,7 @@ class GamePatcher:
     def _patch(self):
         assert self.gameinfo is not None
         other = SimpleNamespace(name="OTHER")
-        readying_task = self.progress.add_task(
-            description="Prelimary",
-            total=self.gameinfo.get_moving_persistent_audioassests_to_streaming_bytes()
-            + self.downloader.get_deprecated_bytes(self.gameinfo.path),
-            kolor="wheat4",
-            lang=other,
-        )
-        PatchProcesser.step_move_audioassests_from_persistent_to_streamingassets(
-            self.gameinfo.audioassests[AudioAsset.PERSISTENT],
-            self.gameinfo.audioassests[AudioAsset.STREAMING],
-            other,
-            self.progress,
-            readying_task,
-        )
-        PatchProcesser.step_delete_deprecated_files(
-            self.gameinfo.path,
-            self.downloader.deprecated_files,
-            other,
-            self.progress,
-            readying_task,
-        )
-        self.progress.remove_task(readying_task)
+        self._ready(other)
         self.downloader_thread = Thread(
             target=self.downloader.download_game_update,
             name="Downloader",
@@ -118,6 +164,31 @@ class GamePatcher:
         )
         self.progress.remove_task(finishing_task)
 
+    def _ready(self, other: SimpleNamespace):
+        assert self.gameinfo is not None
+        readying_task = self.progress.add_task(
+            description="Prelimary",
+            total=self.gameinfo.get_moving_persistent_audioassests_to_streaming_bytes()
+            + self.downloader.get_deprecated_bytes(self.gameinfo.path),
+            kolor="wheat4",
+            lang=other,
+        )
+        PatchProcesser.step_move_audioassests_from_persistent_to_streamingassets(
+            self.gameinfo.audioassests[AudioAsset.PERSISTENT],
+            self.gameinfo.audioassests[AudioAsset.STREAMING],
+            other,
+            self.progress,
+            readying_task,
+        )
+        PatchProcesser.step_delete_deprecated_files(
+            self.gameinfo.path,
+            self.downloader.deprecated_files,
+            other,
+            self.progress,
+            readying_task,
+        )
+        self.progress.remove_task(readying_task)
+
     def _consume_downloaded_file(self):
         LOGGER.debug("Entering update file consumer")
         game_path = (
@@ -144,6 +215,14 @@ class GamePatcher:
                 continue
             assert isinstance(update_file, UpdateFile)
             assert task_id is not None
+            # finished work of an interrupted run is replayed from the journal and skipped
+            journal = PatchJournal(
+                PatchJournal.journal_file(
+                    self.config.log_path, update_file.lang, update_file.version
+                )
+            )
+            if self.md5_cache is not None:
+                self._drop_up_to_date(update_file, game_path, self.md5_cache)
             self.progress.reset(
                 task_id,
                 total=update_file.get_patch_bytes(game_path),
@@ -157,6 +236,13 @@ class GamePatcher:
                 update_file.deletefiles,
                 self.progress,
                 task_id,
+                journal,
+            )
+            # the files checked while written aren't read back by the verify step
+            write_verifier = (
+                WriteVerifier(update_file.pkg_version)
+                if self.config.verify_on_write
+                else None
             )
             PatchProcesser.step_extract_files(
                 game_path,
@@ -169,16 +255,59 @@ class GamePatcher:
                 self.hpatchzpath,
                 self.progress,
                 task_id,
-            )
-            PatchProcesser.step_verify_files(
-                game_path,
-                update_file.lang,
-                update_file.raw_pkg_version,
+                journal,
+                update_file.index,
+                self.config.extract_workers,
+                self.config.read_ahead,
+                self.config.patch_workers,
+                self.config.patch_budget,
                 update_file.pkg_version,
-                self.progress,
-                task_id,
+                write_verifier,
+                self.config.archive_order,
             )
+            try:
+                PatchProcesser.step_verify_files(
+                    game_path,
+                    update_file.lang,
+                    update_file.pkg_version,
+                    self.progress,
+                    task_id,
+                    journal,
+                    self.md5_cache,
+                    self.config.verify_workers,
+                    write_verifier,
+                )
+            finally:
+                # the files that passed are trusted by the rerun after fixing the others
+                if self.md5_cache is not None:
+                    self.md5_cache.save()
+            journal.close(finished=True)
             self._signal_item_done(task_id, update_file)
+        # nothing is patched after the sentinel, the hpatchz event loop isn't needed anymore
+        HPatchZSupervisor.close_shared()
+
+    @staticmethod
+    def _drop_up_to_date(update_file: UpdateFile, game_path: Path, md5_cache: Md5Cache):
+        unchanged = update_file.drop_unchanged_inpkgfiles(game_path, md5_cache)
+        patched, patched_bytes = update_file.drop_patched_hdifffiles(
+            game_path, md5_cache
+        )
+        # the extraction of inpkg and hdiff files, and the files hpatchz would write
+        avoided = (
+            sum(info.file_size for info in unchanged)
+            + sum(info.file_size for info in patched)
+            + patched_bytes
+        )
+        md5_cache.save()
+        LOGGER.success(
+            "Incremental %s: skipping %d inpkg files and %d hdiff patches already up to date in %s, avoiding %d bytes of writes",
+            update_file.lang,
+            len(unchanged),
+            len(patched),
+            game_path,
+            avoided,
+        )
+        return avoided
 
     def _signal_item_done(
         self, task_id: TaskID | None, update_file: UpdateFile | SimpleNamespace | None
@@ -0,0 +1,221 @@
+import re
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Collection, Optional
+from zipfile import BadZipFile, ZipFile
+
+from game.gamelanguage import GameLanguage
+from setuptools._vendor.packaging import version as semver
+from util.logger import LOGGER
+from util.splitreader import SplitReader
+
+
+class GameScanner:
+    # game_4.0.1_4.1.0_hdiff_abcdefghijklmnop.zip, en-us_4.0.1_4.1.0_hdiff_abcdefghijklmnop.zip
+    UPDATE_ARCHIVE = re.compile(
+        r"^(?P<code>[a-z]+(?:-[a-z]+)?)_(?P<old>\d+\.\d+\.\d+)_(?P<new>\d+\.\d+\.\d+)_hdiff_\w+\.zip$"
+    )
+    # Audio_English(US)_4.3.0.zip
+    LANG_ARCHIVE = re.compile(r"^Audio_(?P<name>.+)_(?P<new>\d+\.\d+\.\d+)\.zip$")
+    # GenshinImpact_4.3.0.zip, GenshinImpact_4.3.0.zip.001
+    GAME_ARCHIVE = re.compile(
+        r"^(?P<prefix>[A-Za-z]+)_(?P<new>\d+\.\d+\.\d+)\.zip(?:\.(?P<part>\d+))?$"
+    )
+
+    @staticmethod
+    def scan(
+        patch_path: Path,
+        game_version: Optional[semver.Version],
+        langs: Collection[GameLanguage],
+    ):
+        LOGGER.info(
+            "Scanning %s for archives, installed version %s, languages %s",
+            patch_path,
+            game_version,
+            langs,
+        )
+        updates: dict[tuple[GameLanguage, str, str], Path] = {}
+        downloads: dict[tuple[GameLanguage, str], list[Path]] = {}
+        for file in sorted(patch_path.iterdir()):
+            if not file.is_file() or GameScanner.is_incomplete(file):
+                continue
+            if match := GameScanner.UPDATE_ARCHIVE.match(file.name):
+                try:
+                    lang = GameLanguage.get_bycode(match["code"])
+                except KeyError:
+                    continue
+                updates[(lang, match["old"], match["new"])] = file
+            elif match := GameScanner.LANG_ARCHIVE.match(file.name):
+                try:
+                    lang = GameLanguage.get_byname(match["name"])
+                except KeyError:
+                    continue
+                downloads.setdefault((lang, match["new"]), []).append(file)
+            elif match := GameScanner.GAME_ARCHIVE.match(file.name):
+                downloads.setdefault((GameLanguage.GAME, match["new"]), []).append(file)
+        LOGGER.debug("Found update archives %s, full archives %s", updates, downloads)
+        if game_version is not None:
+            return GameScanner._build_update(updates, game_version, langs)
+        return GameScanner._build_download(downloads, langs)
+
+    @staticmethod
+    def is_incomplete(file: Path):
+        # DownloadFile keeps these next to an archive until it is complete
+        return (
+            file.suffix in (".segments", ".md5", ".tmp")
+            or file.with_name(f"{file.name}.segments").exists()
+        )
+
+    @staticmethod
+    def holds(files: list[Path], lang: GameLanguage):
+        # the name may lie, the central directory must have the pkg_version of the language
+        try:
+            with ExitStack() as ws:
+                if len(files) > 1:
+                    sfr = ws.enter_context(SplitReader(files))
+                    zf = ws.enter_context(ZipFile(sfr))  # type: ignore
+                else:
+                    zf = ws.enter_context(ZipFile(files[0]))
+                zf.getinfo(lang.audio_str)
+                return True
+        except (BadZipFile, KeyError, OSError) as e:
+            LOGGER.warning("Ignoring %s, not a complete %s archive: %s", files, lang, e)
+            return False
+
+    @staticmethod
+    def get_verified_md5(file: Path):
+        # the "md5 size mtime_ns" marker of an archive verified while online
+        try:
+            md5, size, mtime_ns = file.with_name(f"{file.name}.md5").read_text().split()
+        except (FileNotFoundError, ValueError):
+            return None
+        stat = file.stat()
+        if int(size) != stat.st_size or int(mtime_ns) != stat.st_mtime_ns:
+            return None
+        return md5
+
+    @staticmethod
+    def _entry(file: Path):
+        return {
+            "path": file.name,
+            "package_size": str(file.stat().st_size),
+            "md5": GameScanner.get_verified_md5(file),
+        }
+
+    @staticmethod
+    def _build_update(
+        updates: dict[tuple[GameLanguage, str, str], Path],
+        game_version: semver.Version,
+        langs: Collection[GameLanguage],
+    ):
+        targets = sorted(
+            {
+                semver.Version(new)
+                for (lang, old, new) in updates
+                if lang is GameLanguage.GAME and old == str(game_version)
+            },
+            reverse=True,
+        )
+        for target in targets:
+            found = {
+                lang: updates.get((lang, str(game_version), str(target)))
+                for lang in (GameLanguage.GAME, *langs)
+            }
+            missing = [lang for lang, file in found.items() if file is None]
+            if missing:
+                LOGGER.warning(
+                    "Can't update %s to %s offline, missing archives of %s",
+                    game_version,
+                    target,
+                    missing,
+                )
+                continue
+            if not all(
+                GameScanner.holds([file], lang) for lang, file in found.items() if file
+            ):
+                continue
+            LOGGER.notice(
+                "Offline update from %s to %s with %s", game_version, target, found
+            )
+            game_file = found.pop(GameLanguage.GAME)
+            assert game_file is not None
+            return GameScanner._api_result(
+                target,
+                [],
+                [],
+                [
+                    {
+                        "version": str(game_version),
+                        **GameScanner._entry(game_file),
+                        "voice_packs": [
+                            {"language": str(lang), **GameScanner._entry(file)}
+                            for lang, file in found.items()
+                            if file is not None
+                        ],
+                    }
+                ],
+            )
+        raise FileNotFoundError(
+            f"No complete set of update archives from version {game_version} for languages {langs}"
+        )
+
+    @staticmethod
+    def _build_download(
+        downloads: dict[tuple[GameLanguage, str], list[Path]],
+        langs: Collection[GameLanguage],
+    ):
+        targets = sorted(
+            {
+                semver.Version(new)
+                for (lang, new) in downloads
+                if lang is GameLanguage.GAME
+            },
+            reverse=True,
+        )
+        for target in targets:
+            found = {
+                lang: downloads.get((lang, str(target)))
+                for lang in (GameLanguage.GAME, *langs)
+            }
+            if any(files is None for files in found.values()) or not all(
+                GameScanner.holds(files, lang) for lang, files in found.items() if files
+            ):
+                LOGGER.warning("Can't install %s offline, archives %s", target, found)
+                continue
+            LOGGER.notice("Offline installation of %s with %s", target, found)
+            game_files = found.pop(GameLanguage.GAME)
+            assert game_files is not None
+            return GameScanner._api_result(
+                target,
+                [GameScanner._entry(file) for file in game_files],
+                [
+                    {"language": str(lang), **GameScanner._entry(files[0])}
+                    for lang, files in found.items()
+                    if files is not None
+                ],
+                [],
+            )
+        raise FileNotFoundError(
+            f"No complete set of full game archives for languages {langs}"
+        )
+
+    @staticmethod
+    def _api_result(
+        version: semver.Version, segments: list, voice_packs: list, diffs: list
+    ):
+        # shaped like the mhy api, so GameDownloader.read_api_result reads it the same way
+        return {
+            "data": {
+                "game": {
+                    "latest": {
+                        "version": str(version),
+                        "segments": segments,
+                        "voice_packs": voice_packs,
+                        "decompressed_path": None,
+                    },
+                    "diffs": diffs,
+                },
+                "pre_download_game": None,
+                "deprecated_files": [],
+            }
+        }
@@ -1,20 +1,28 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import ExitStack
 from dataclasses import dataclass, field
 from enum import Enum
-from json import loads
-from msvcrt import get_osfhandle
+from hashlib import file_digest, md5
+from json import dumps, loads
 from pathlib import Path
 from sys import getsizeof
-from typing import Callable, Collection, Optional
-from zipfile import ZipFile, ZipInfo
+from threading import Lock
+from typing import Callable, Collection, Iterable, Optional, Sequence
+from zlib import error as zlib_error
+from zipfile import BadZipFile, ZipFile, ZipInfo
 
 from game.gamelanguage import GameLanguage
 from httpx import Client, HTTPError
 from retry import retry
 from setuptools._vendor.packaging import version as semver
-from split_file_reader import SplitFileReader
 from util.logger import LOGGER
-from win32file import FileAllocationInfo, SetFileInformationByHandle
+from util.md5cache import Md5Cache
+from util.platformio import PlatformIO
+from util.remotefile import RemoteFile
+from util.splitreader import SplitReader
+from util.zipindex import ZipIndex
 
 
 class AudioAsset(Enum):
@@ -35,68 +43,166 @@ class Entry_pkg_version:
             Path(line["remoteName"]), line["md5"], int(line["fileSize"])
         )
 
+    def matches(self, file: Path, md5_cache: Optional[Md5Cache] = None):
+        try:
+            if file.stat().st_size != self.fileSize:
+                return False
+        except FileNotFoundError:
+            return False
+        if md5_cache is not None:
+            return md5_cache.md5(file) == self.md5
+        with file.open("rb") as f:
+            return file_digest(f, "md5").hexdigest() == self.md5
+
+
+class CompactManifest:
+    # one entry costs its utf-8 name, an offset, a 16 byte digest and a size, instead of a dataclass and a Path
+    def __init__(self, raw: bytes):
+        rows = sorted(
+            (
+                line["remoteName"].encode(),
+                bytes.fromhex(line["md5"]),
+                int(line["fileSize"]),
+            )
+            for line in map(loads, filter(bytes.strip, raw.splitlines()))
+        )
+        self.names = b"".join(name for name, _, _ in rows)
+        self.offsets = array("Q", [0])
+        for name, _, _ in rows:
+            self.offsets.append(self.offsets[-1] + len(name))
+        self.md5s = b"".join(digest for _, digest, _ in rows)
+        self.sizes = array("Q", (size for _, _, size in rows))
+        # the manifest file itself is only compared, its bytes aren't kept
+        self.raw_md5 = md5(raw).digest()
+        self.raw_size = len(raw)
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __iter__(self):
+        return (self.entry(i) for i in range(len(self)))
+
+    def name(self, i: int):
+        return self.names[self.offsets[i] : self.offsets[i + 1]].decode()
+
+    def entry(self, i: int):
+        return Entry_pkg_version(
+            Path(self.name(i)), self.md5s[i * 16 : i * 16 + 16].hex(), self.sizes[i]
+        )
+
+    def get(self, name: str) -> Optional[Entry_pkg_version]:
+        i = self.index(name)
+        return self.entry(i) if i >= 0 else None
+
+    def index(self, name: str):
+        # a binary search for one name, lookup walks all of them
+        encoded = name.encode()
+        i = bisect_left(range(len(self.sizes)), encoded, key=self._name_bytes)
+        return i if i < len(self.sizes) and self._name_bytes(i) == encoded else -1
+
+    def lookup(self, names: Sequence[str]):
+        # a merge of two sorted lists, instead of hashing every name into a set
+        found = array("q", [-1]) * len(names)
+        queries = sorted((name.encode(), q) for q, name in enumerate(names))
+        i = 0
+        for name, q in queries:
+            while i < len(self.sizes) and self._name_bytes(i) < name:
+                i += 1
+            if i == len(self.sizes):
+                break
+            if self._name_bytes(i) == name:
+                found[q] = i
+        return found
+
+    def total_size(self, indices: Iterable[int] = ()):
+        return sum(self.sizes[i] for i in indices if i >= 0)
+
+    def _name_bytes(self, i: int):
+        return self.names[self.offsets[i] : self.offsets[i + 1]]
+
 
 class UpdateFile:
+    # parsed from the archive and kept in its index
+    INDEXED = (
+        "deletefiles",
+        "hdifffiles",
+        "hdifffiles_wext",
+        "pkg_version",
+        "hdifffiles_info",
+        "inpkgfiles_info",
+        "standalonefiles_info",
+    )
+
     def __init__(
         self,
         update_file: Path | list[Path],
         lang: GameLanguage,
         version: tuple[Optional[semver.Version], semver.Version],
+        opened: Optional[ZipFile] = None,
     ):
         self.path = update_file
         self.lang = lang
         self.version = version
+        # parsed members of a local archive, loaded again instead of reading the central directory
+        self.index = ZipIndex.load(update_file, str(lang)) if opened is None else None
+        if self.index is not None:
+            self.__dict__.update(self.index.data)
+            return
         with ExitStack() as ws:
-            if isinstance(update_file, list):
-                sfr = ws.enter_context(SplitFileReader(update_file))
+            # the archive can also be read from somewhere else, like its remote central directory
+            if opened is not None:
+                zf = opened
+            elif isinstance(update_file, list):
+                sfr = ws.enter_context(SplitReader(update_file))
                 zf = ws.enter_context(ZipFile(sfr))  # type: ignore
             elif isinstance(update_file, Path):
                 zf = ws.enter_context(ZipFile(update_file))
             self.deletefiles = self.get_deletefiles(zf)
             self.hdifffiles = self.get_hdifffiles(zf)
             self.hdifffiles_wext = self.get_hdifffiles_wext(self.hdifffiles)
-            self.raw_pkg_version, self.pkg_version = self.get_pkg_version(zf, self.lang)
-            self.inpkgfiles = self.get_inpkgfiles(self.pkg_version)
+            self.pkg_version = self.get_pkg_version(zf, self.lang)
+            infolist = zf.infolist()
+            # the manifest entry of every member, -1 for the members that aren't in it
+            in_manifest = self.pkg_version.lookup([info.filename for info in infolist])
             self.hdifffiles_info = self.get_hdifffiles_info(zf, self.hdifffiles_wext)
-            self.inpkgfiles_info = self.get_inpkgfiles_info(zf, self.inpkgfiles)
+            self.inpkgfiles_info = self.get_inpkgfiles_info(infolist, in_manifest)
             self.standalonefiles_info = self.get_standalonefiles_info(
-                zf, self.inpkgfiles_info, self.hdifffiles_info
+                infolist, in_manifest, self.hdifffiles_info
             )
+            if opened is None:
+                self.index = ZipIndex.from_zipfile(
+                    zf,
+                    update_file,
+                    str(lang),
+                    {name: getattr(self, name) for name in self.INDEXED},
+                )
+                self.index.save(update_file)
 
     @staticmethod
     def get_standalonefiles_info(
-        zf: ZipFile,
-        inpkgfiles_info: Collection[ZipInfo],
+        infolist: list[ZipInfo],
+        in_manifest: Sequence[int],
         hdifffiles_info: Collection[ZipInfo],
     ):
-        return {
+        hdifffiles = {info.filename for info in hdifffiles_info}
+        # exclude directories, the aforementioned ritual, inpkg files (in the manifest) and hdiff files
+        return [
             info
-            for info in zf.infolist()
-            # exclude directories? (from )
+            for info, entry in zip(infolist, in_manifest)
             if not info.is_dir()
-            # not the aforementioned ritual
-            and info.filename != "deletefiles.txt"
-            and info.filename != "hdifffiles.txt"
-            and info not in inpkgfiles_info
-            and info not in hdifffiles_info
-        }
+            and info.filename not in ("deletefiles.txt", "hdifffiles.txt")
+            and entry < 0
+            and info.filename not in hdifffiles
+        ]
 
     @staticmethod
-    def get_inpkgfiles_info(zf: ZipFile, inpkgfiles: Collection[Path]):
-        return {
-            # these can't include directories and they will be pushed to standlonefiles
-            info
-            for info in zf.infolist()
-            if Path(info.filename) in inpkgfiles
-        }
+    def get_inpkgfiles_info(infolist: list[ZipInfo], in_manifest: Sequence[int]):
+        # these can't include directories and they will be pushed to standlonefiles
+        return [info for info, entry in zip(infolist, in_manifest) if entry >= 0]
 
     @staticmethod
     def get_hdifffiles_info(zf: ZipFile, hdifffiles_wext: Collection[Path]):
-        return {zf.getinfo(hdf.as_posix()) for hdf in hdifffiles_wext}
-
-    @staticmethod
-    def get_inpkgfiles(pkg_version: Collection[Entry_pkg_version]):
-        return {entry.remoteName for entry in pkg_version}
+        return [zf.getinfo(hdf.as_posix()) for hdf in hdifffiles_wext]
 
     @staticmethod
     def get_hdifffiles_wext(hdifffiles: Collection[Path]):
@@ -104,12 +210,7 @@ class UpdateFile:
 
     @staticmethod
     def get_pkg_version(ofile: ZipFile, lang: GameLanguage):
-        raw = ofile.read(lang.audio_str)
-        return raw, {
-            Entry_pkg_version.from_json(line.strip())
-            for line in raw.decode().splitlines()
-            if line
-        }
+        return CompactManifest(ofile.read(lang.audio_str))
 
     @staticmethod
     def get_deletefiles(ofile: ZipFile) -> set[Path]:
@@ -133,6 +234,83 @@ class UpdateFile:
         except KeyError:
             return set()
 
+    @staticmethod
+    def get_member_ranges(
+        zf: ZipFile, infos: Collection[ZipInfo], archive_size: int, merge_gap: int
+    ):
+        # a member spans from its local header to the next local header, or the central directory
+        offsets = sorted(info.header_offset for info in zf.infolist())
+        offsets.append(zf.start_dir)
+        ranges = sorted(
+            (
+                info.header_offset,
+                offsets[bisect_right(offsets, info.header_offset)],
+            )
+            for info in infos
+        )
+        # the central directory is needed to open the local copy
+        ranges.append((zf.start_dir, archive_size))
+        merged = [list(ranges[0])]
+        for start, end in ranges[1:]:
+            if start - merged[-1][1] <= merge_gap:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return [(start, end) for start, end in merged]
+
+    def drop_unchanged_inpkgfiles(
+        self, game_path: Path, md5_cache: Optional[Md5Cache] = None
+    ):
+        in_manifest = self.pkg_version.lookup(
+            [info.filename for info in self.inpkgfiles_info]
+        )
+        changed: list[ZipInfo] = []
+        unchanged: list[ZipInfo] = []
+        for info, entry in zip(self.inpkgfiles_info, in_manifest):
+            if self.pkg_version.entry(entry).matches(
+                game_path / info.filename, md5_cache
+            ):
+                unchanged.append(info)
+            else:
+                changed.append(info)
+        self.inpkgfiles_info = changed
+        LOGGER.info(
+            "Dropped %d inpkg files of size %d that are already identical in %s",
+            len(unchanged),
+            sum(info.file_size for info in unchanged),
+            game_path,
+        )
+        return unchanged
+
+    def drop_patched_hdifffiles(
+        self, game_path: Path, md5_cache: Optional[Md5Cache] = None
+    ):
+        # an old file that already is the new one from the manifest was patched by an earlier run
+        patched_names = [
+            Path(info.filename).with_suffix("").as_posix()
+            for info in self.hdifffiles_info
+        ]
+        in_manifest = self.pkg_version.lookup(patched_names)
+        unpatched: list[ZipInfo] = []
+        patched: list[ZipInfo] = []
+        patched_bytes = 0
+        for info, name, entry in zip(self.hdifffiles_info, patched_names, in_manifest):
+            if entry >= 0 and self.pkg_version.entry(entry).matches(
+                game_path / name, md5_cache
+            ):
+                patched.append(info)
+                patched_bytes += self.pkg_version.sizes[entry]
+            else:
+                unpatched.append(info)
+        self.hdifffiles_info = unpatched
+        LOGGER.info(
+            "Dropped %d hdiff files of size %d whose files are already patched in %s",
+            len(patched),
+            sum(info.file_size for info in patched),
+            game_path,
+        )
+        return patched, patched_bytes
+
     def __repr__(self):
         version = f"v=({self.version[0]} -> {self.version[1]})"
         file_name = "".join(
@@ -161,10 +339,13 @@ class UpdateFile:
         return sum(info.file_size for info in self.hdifffiles_info)
 
     def get_patchedhdifffiles_bytes(self):
-        return sum(
-            entry.fileSize
-            for entry in self.pkg_version
-            if entry.remoteName in self.hdifffiles
+        return self.pkg_version.total_size(
+            self.pkg_version.lookup(
+                [
+                    Path(info.filename).with_suffix("").as_posix()
+                    for info in self.hdifffiles_info
+                ]
+            )
         )
 
     def get_inpkgfiles_bytes(self):
@@ -174,10 +355,10 @@ class UpdateFile:
         return sum(info.file_size for info in self.standalonefiles_info)
 
     def get_verify_bytes(self):
-        return sum(pv.fileSize for pv in self.pkg_version)
+        return sum(self.pkg_version.sizes)
 
     def get_pkg_version_bytes(self):
-        return len(self.raw_pkg_version)
+        return self.pkg_version.raw_size
 
     def get_patch_bytes(self, game_path: Path):
         return (
@@ -198,7 +379,74 @@ class UpdateFile:
         )
 
 
+class DownloadIntegrityError(Exception):
+    def __init__(
+        self,
+        file: Path,
+        expected_md5: str,
+        actual_md5: str,
+        *args: object,
+    ) -> None:
+        self.file = file
+        self.expected_md5 = expected_md5
+        self.actual_md5 = actual_md5
+        super().__init__(
+            f"DownloadIntegrityError: {file} md5 {actual_md5} isn't expected {expected_md5}",
+            *args,
+        )
+
+
+class OrderedHasher:
+    READ_BUFSIZE = 1024 * 1024
+
+    # segments are written out of order, but md5 has to see the file from start to end
+    def __init__(self, file: Path, segments: list[list[int]]):
+        self.file = file
+        self.segments = segments
+        self.hasher = md5()
+        # everything before this offset has been hashed
+        self.frontier = 0
+        self.read_back = 0
+        self._lock = Lock()
+
+    def update(self, position: int, chunk: bytes):
+        # only the chunk written right at the frontier can be hashed without reading it back
+        with self._lock:
+            if position == self.frontier:
+                self.hasher.update(chunk)
+                self.frontier += len(chunk)
+
+    def catch_up(self):
+        # reads back what was flushed past the frontier, like a resumed prefix or a segment ahead of it
+        with self._lock:
+            for start, end, position in sorted(self.segments):
+                if start > self.frontier or end <= self.frontier:
+                    continue
+                if self.frontier < position:
+                    with self.file.open("rb") as f:
+                        f.seek(self.frontier)
+                        while self.frontier < position:
+                            chunk = f.read(
+                                min(self.READ_BUFSIZE, position - self.frontier)
+                            )
+                            self.hasher.update(chunk)
+                            self.frontier += len(chunk)
+                            self.read_back += len(chunk)
+                if position < end:
+                    break
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
 class DownloadFile:
+    # segments smaller than this are not worth another connection
+    MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+    # how many bytes a segment writes before its resume state is saved
+    SEGMENT_CHECKPOINT = 16 * 1024 * 1024
+    # unneeded bytes between two needed members that are cheaper to fetch than another request
+    RANGE_MERGE_GAP = 1024 * 1024
+
     def __init__(
         self,
         link: str,
@@ -207,6 +455,10 @@ class DownloadFile:
         version: tuple[Optional[semver.Version], semver.Version],
         progress_callback: Callable[[int], None],
         lang: Optional[GameLanguage] = None,
+        segments: int = 1,
+        throttle: Optional[Callable[[int], None]] = None,
+        game_path: Optional[Path] = None,
+        md5: Optional[str] = None,
     ):
         self.link = link
         self.file = file
@@ -218,6 +470,19 @@ class DownloadFile:
             self.currentsize = -1
         self.progress_callback = progress_callback
         self.lang = lang
+        self.segments = segments
+        # called with every received chunk size, blocks to keep the bandwidth cap
+        self.throttle = throttle
+        # only fetch the members that aren't already identical in the game into a sparse local copy
+        self.game_path = game_path
+        # [start, end, position] of every byte range, kept next to the file while it is incomplete
+        self.state_file = self.file.with_name(f"{self.file.name}.segments")
+        self._state_lock = Lock()
+        # expected md5 from the api, checked while the file is being written
+        self.md5 = md5
+        self.hasher: Optional[OrderedHasher] = None
+        # "md5 size mtime_ns" of a verified file, so a finished download isn't hashed again
+        self.verified_file = self.file.with_name(f"{self.file.name}.md5")
 
     def download(self, client: Optional[Client] = None):
         LOGGER.info(
@@ -227,23 +492,66 @@ class DownloadFile:
             self.currentsize,
             self.fullsize,
         )
-        if self.currentsize >= self.fullsize:
+        if client is None:
+            with Client() as client:
+                return self._download_any(client)
+        return self._download_any(client)
+
+    def is_complete(self):
+        return self.currentsize >= self.fullsize and not self.state_file.exists()
+
+    def replaced(self):
+        # the file was swapped for a complete copy, like one from the archive cache
+        self.state_file.unlink(True)
+        self.currentsize = self.file.stat().st_size
+
+    def _download_any(self, client: Client):
+        completed = self.is_complete()
+        if self.game_path is not None and self.lang is not None and not completed:
+            return self._download_members(client, self.game_path)
+        if completed:
             LOGGER.info(
                 "File %s has already been downloaded in full size %d",
                 self.file,
                 self.currentsize,
             )
             self.progress_callback(self.currentsize)
+        # a leftover state file means the file was preallocated to full size by a segmented download
+        elif self.segments > 1 or self.state_file.exists():
+            self._download_segmented(client)
         else:
-            if client is None:
-                with Client() as client:
-                    self._download(client)
-            else:
-                self._download(client)
+            self._download(client)
+        self._verify(client)
         return (
             UpdateFile(self.file, self.lang, self.version) if self.lang else self.file
         )
 
+    def _download_members(self, client: Client, game_path: Path):
+        assert self.lang is not None
+        with RemoteFile(client, self.link, self.fullsize) as rf, ZipFile(rf) as zf:
+            update_file = UpdateFile(self.file, self.lang, self.version, zf)
+            update_file.drop_unchanged_inpkgfiles(game_path)
+            ranges = UpdateFile.get_member_ranges(
+                zf,
+                (
+                    *update_file.standalonefiles_info,
+                    *update_file.inpkgfiles_info,
+                    *update_file.hdifffiles_info,
+                ),
+                self.fullsize,
+                self.RANGE_MERGE_GAP,
+            )
+            LOGGER.info(
+                "Downloading %d ranges of size %d out of %d from %s, central directory took %d",
+                len(ranges),
+                sum(end - start for start, end in ranges),
+                self.fullsize,
+                self.link,
+                rf.fetched_bytes,
+            )
+        self._download_segmented(client, ranges)
+        return update_file
+
     @retry(HTTPError, delay=2, backoff=2, max_delay=60, logger=LOGGER)
     def _download(self, client: Client):
         something_was_downloaded = self.currentsize > 0
@@ -251,6 +559,12 @@ class DownloadFile:
             self.progress_callback(self.currentsize)
         else:
             self.currentsize = 0
+        if self.md5 is not None and self.hasher is None:
+            # a resumed prefix is hashed once, a retry continues from where it was
+            self.hasher = OrderedHasher(
+                self.file, [[0, self.fullsize, self.currentsize]]
+            )
+            self.hasher.catch_up()
         with client.stream(
             "GET",
             self.link,
@@ -262,14 +576,268 @@ class DownloadFile:
             assert (
                 receiving_bytes + self.currentsize == self.fullsize
             ), f"Content-Length={receiving_bytes} + {self.currentsize=} != {self.fullsize=}"
-            # preallocate file
-            SetFileInformationByHandle(
-                get_osfhandle(fl.fileno()),
-                FileAllocationInfo,
-                self.fullsize,
-            )
+            self._preallocate(fl)
             for chunk in dl.iter_bytes():
                 if chunk:
+                    if self.throttle is not None:
+                        self.throttle(len(chunk))
                     leng = fl.write(chunk)
+                    if self.hasher is not None:
+                        self.hasher.update(self.currentsize, chunk)
                     self.currentsize += leng
                     self.progress_callback(leng)
+
+    def _download_segmented(
+        self,
+        client: Client,
+        wanted: Optional[list[tuple[int, int]]] = None,
+        repairing: bool = False,
+    ):
+        segments = self._load_segments()
+        fresh = segments is None
+        if segments is None:
+            # bytes of a previous single stream download are kept as a finished segment
+            done = max(self.currentsize, 0)
+            segments = [[0, done, done]] if done else []
+        sparse = wanted is not None
+        if self._plan_segments(segments, wanted or [(0, self.fullsize)]) or fresh:
+            # state must exist before the file grows to full size, or a crash would look like a finished download
+            self._save_segments(segments)
+        if fresh:
+            with self.file.open("r+b" if self.currentsize > 0 else "wb") as fl:
+                if sparse:
+                    self._make_sparse(fl)
+                else:
+                    self._preallocate(fl)
+                fl.truncate(self.fullsize)
+        # a sparse copy never has the md5 of the whole archive, a repair is hashed again afterwards
+        if self.md5 is not None and not sparse and not repairing:
+            self.hasher = OrderedHasher(self.file, segments)
+            self.hasher.catch_up()
+        pending = [seg for seg in segments if seg[2] < seg[1]]
+        LOGGER.debug(
+            "Downloading file %s in %d segments, %d pending",
+            self.file,
+            len(segments),
+            len(pending),
+        )
+        if not repairing:
+            # the holes a sparse copy skips count as done, or its task never reaches the full size
+            skipped = sum(
+                end - start
+                for start, end in self._uncovered(segments, [(0, self.fullsize)])
+            )
+            self.progress_callback(sum(seg[2] - seg[0] for seg in segments) + skipped)
+        if pending:
+            with ThreadPoolExecutor(
+                max_workers=min(len(pending), max(self.segments, 1)),
+                thread_name_prefix="Segment",
+            ) as executor:
+                # list() so the first failing segment raises here
+                list(
+                    executor.map(
+                        lambda seg: self._download_segment(client, segments, seg),
+                        pending,
+                    )
+                )
+        assert all(
+            seg[2] == seg[1] for seg in segments
+        ), f"Segments of {self.file} are incomplete {segments}"
+        if self._uncovered(segments, [(0, self.fullsize)]):
+            # a sparse copy keeps its state, so a full download later only fetches the holes
+            return
+        self.state_file.unlink()
+        self.currentsize = self.fullsize
+
+    @retry(HTTPError, delay=2, backoff=2, max_delay=60, logger=LOGGER)
+    def _download_segment(
+        self, client: Client, segments: list[list[int]], segment: list[int]
+    ):
+        start, end, position = segment
+        LOGGER.trace(
+            "Downloading segment %d-%d of file %s from position %d",
+            start,
+            end,
+            self.file,
+            position,
+        )
+        with client.stream(
+            "GET", self.link, headers={"Range": f"bytes={position}-{end - 1}"}
+        ) as dl, self.file.open("r+b") as fl:
+            receiving_bytes = int(dl.headers["Content-Length"])
+            assert (
+                dl.status_code == 206 and receiving_bytes == end - position
+            ), f"{dl.status_code=} Content-Length={receiving_bytes} != {end=} - {position=}"
+            fl.seek(position)
+            checkpoint = position + self.SEGMENT_CHECKPOINT
+            try:
+                for chunk in dl.iter_bytes():
+                    if chunk:
+                        if self.throttle is not None:
+                            self.throttle(len(chunk))
+                        leng = fl.write(chunk)
+                        if self.hasher is not None:
+                            self.hasher.update(position, chunk)
+                        position += leng
+                        self.progress_callback(leng)
+                        if position >= checkpoint:
+                            fl.flush()
+                            self._checkpoint_segment(segments, segment, position)
+                            checkpoint = position + self.SEGMENT_CHECKPOINT
+            finally:
+                # only bytes that reached the file are remembered, retries continue from here
+                fl.flush()
+                self._checkpoint_segment(segments, segment, position)
+
+    def _plan_segments(
+        self, segments: list[list[int]], wanted: list[tuple[int, int]]
+    ) -> bool:
+        planned = False
+        for start, end in self._uncovered(segments, wanted):
+            gap = end - start
+            count = max(1, min(self.segments, gap // self.MIN_SEGMENT_SIZE))
+            step = -(-gap // count)
+            segments.extend(
+                [position, min(position + step, end), position]
+                for position in range(start, end, step)
+            )
+            planned = True
+        segments.sort()
+        return planned
+
+    @staticmethod
+    def _uncovered(segments: list[list[int]], wanted: list[tuple[int, int]]):
+        covered = sorted((seg[0], seg[1]) for seg in segments)
+        gaps: list[tuple[int, int]] = []
+        for start, end in wanted:
+            for seg_start, seg_end in covered:
+                if seg_end <= start or seg_start >= end:
+                    continue
+                if seg_start > start:
+                    gaps.append((start, seg_start))
+                start = max(start, seg_end)
+            if start < end:
+                gaps.append((start, end))
+        return gaps
+
+    def _load_segments(self) -> Optional[list[list[int]]]:
+        try:
+            state = loads(self.state_file.read_text())
+        except FileNotFoundError:
+            return None
+        assert (
+            state["size"] == self.fullsize
+        ), f"Segment state {self.state_file} is for size {state['size']}, not {self.fullsize}"
+        return state["segments"]
+
+    def _checkpoint_segment(
+        self, segments: list[list[int]], segment: list[int], position: int
+    ):
+        with self._state_lock:
+            segment[2] = position
+            self._save_segments(segments)
+        if self.hasher is not None:
+            self.hasher.catch_up()
+
+    def _save_segments(self, segments: list[list[int]]):
+        temp = self.state_file.with_name(f"{self.state_file.name}.tmp")
+        temp.write_text(dumps({"size": self.fullsize, "segments": segments}))
+        temp.replace(self.state_file)
+
+    def _verify(self, client: Client):
+        if self.md5 is None:
+            return
+        stat = self.file.stat()
+        marker = f"{self.md5} {stat.st_size} {stat.st_mtime_ns}"
+        try:
+            if self.verified_file.read_text() == marker:
+                LOGGER.debug(
+                    "File %s was already verified with md5 %s", self.file, self.md5
+                )
+                return
+        except FileNotFoundError:
+            pass
+        if self.hasher is None:
+            # the file was complete before this run started
+            self.hasher = OrderedHasher(self.file, [[0, self.fullsize, self.fullsize]])
+        self.hasher.catch_up()
+        LOGGER.debug(
+            "Verifying file %s md5 %s, expecting %s, read back %d bytes",
+            self.file,
+            self.hasher.hexdigest(),
+            self.md5,
+            self.hasher.read_back,
+        )
+        if self.hasher.hexdigest() != self.md5:
+            LOGGER.warning(
+                "File %s md5 %s isn't expected %s, refetching the damaged part",
+                self.file,
+                self.hasher.hexdigest(),
+                self.md5,
+            )
+            self._repair(client)
+            with self.file.open("rb") as f:
+                hashed = file_digest(f, "md5").hexdigest()
+            if hashed != self.md5:
+                raise DownloadIntegrityError(self.file, self.md5, hashed)
+            stat = self.file.stat()
+            marker = f"{self.md5} {stat.st_size} {stat.st_mtime_ns}"
+        self.verified_file.write_text(marker)
+
+    def _repair(self, client: Client):
+        damaged = self._find_damaged_ranges()
+        # mark everything as done but the damaged ranges, the segmented download then only fetches those
+        segments: list[list[int]] = []
+        position = 0
+        for start, end in damaged:
+            if position < start:
+                segments.append([position, start, start])
+            segments.append([start, end, start])
+            position = end
+        if position < self.fullsize:
+            segments.append([position, self.fullsize, self.fullsize])
+        LOGGER.info(
+            "Refetching %d damaged ranges of size %d of file %s",
+            len(damaged),
+            sum(end - start for start, end in damaged),
+            self.file,
+        )
+        self._save_segments(segments)
+        self.hasher = None
+        self._download_segmented(client, repairing=True)
+
+    def _find_damaged_ranges(self) -> list[tuple[int, int]]:
+        if self.lang is None:
+            # a part of a split archive can't be checked on its own
+            return [(0, self.fullsize)]
+        try:
+            with ZipFile(self.file) as zf:
+                damaged = []
+                for info in zf.infolist():
+                    try:
+                        with zf.open(info) as member:
+                            # the crc is checked once the member is read to its end
+                            while member.read(OrderedHasher.READ_BUFSIZE):
+                                pass
+                    except (BadZipFile, EOFError, zlib_error):
+                        damaged.append(info)
+                LOGGER.debug(
+                    "Found %d damaged members in file %s", len(damaged), self.file
+                )
+                return (
+                    UpdateFile.get_member_ranges(
+                        zf, damaged, self.fullsize, self.RANGE_MERGE_GAP
+                    )
+                    if damaged
+                    else [(0, self.fullsize)]
+                )
+        except BadZipFile:
+            # the central directory itself is damaged
+            return [(0, self.fullsize)]
+
+    @staticmethod
+    def _make_sparse(fl):
+        PlatformIO.make_sparse(fl)
+
+    def _preallocate(self, fl):
+        PlatformIO.preallocate(fl, self.fullsize)
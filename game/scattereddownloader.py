@@ -0,0 +1,186 @@
+from asyncio import Semaphore, gather, run, sleep, to_thread
+from hashlib import md5
+from os import replace
+from pathlib import Path
+from typing import Callable, Optional
+
+from game.gamelanguage import GameLanguage
+from game.gameutil import Entry_pkg_version
+from httpx import AsyncClient, HTTPError
+from util.httpclient import ClientManager
+from util.logger import LOGGER
+from util.md5cache import Md5Cache
+from util.ratelimiter import RATE_LIMITS, IOClass
+
+
+class ScatteredFileError(Exception):
+    def __init__(
+        self,
+        url: str,
+        expected_size: int,
+        actual_size: int,
+        expected_md5: str,
+        actual_md5: str,
+        *args: object,
+    ) -> None:
+        self.url = url
+        self.expected_size = expected_size
+        self.actual_size = actual_size
+        self.expected_md5 = expected_md5
+        self.actual_md5 = actual_md5
+        super().__init__(
+            f"ScatteredFileError: {url} size {actual_size} md5 {actual_md5} isn't expected size {expected_size} md5 {expected_md5}",
+            *args,
+        )
+
+
+class ScatteredDownloader:
+    RETRIES = 5
+    MAX_BACKOFF = 60
+    # partly downloaded files sit next to their target so the final rename stays on one volume
+    TEMP_SUFFIX = ".gsptmp"
+
+    def __init__(
+        self,
+        base_url: str,
+        game_path: Path,
+        concurrency: int,
+        http2: bool = True,
+        md5_cache: Optional[Md5Cache] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.game_path = game_path
+        self.concurrency = concurrency
+        self.http2 = http2
+        self.md5_cache = md5_cache
+
+    def download(
+        self,
+        lang: GameLanguage,
+        progress_reset: Callable[[int], None],
+        progress_callback: Callable[[int], None],
+    ):
+        return run(self._download(lang, progress_reset, progress_callback))
+
+    async def _download(
+        self,
+        lang: GameLanguage,
+        progress_reset: Callable[[int], None],
+        progress_callback: Callable[[int], None],
+    ):
+        async with ClientManager.create_async_client(
+            self.concurrency, self.http2
+        ) as client:
+            raw_pkg_version = await self._fetch_bytes(client, lang.audio_str)
+            entries = {
+                Entry_pkg_version.from_json(line.strip())
+                for line in raw_pkg_version.decode().splitlines()
+                if line
+            }
+            LOGGER.notice(
+                "Syncing %d scattered files of %s from %s to %s",
+                len(entries),
+                lang,
+                self.base_url,
+                self.game_path,
+            )
+            progress_reset(sum(entry.fileSize for entry in entries))
+            semaphore = Semaphore(self.concurrency)
+            downloaded = await gather(
+                *(
+                    self._sync_entry(client, semaphore, entry, progress_callback)
+                    for entry in entries
+                )
+            )
+        # the manifest is placed last, an interrupted sync is still recognised as the old version
+        self._place(lang.audio_str, raw_pkg_version)
+        LOGGER.success(
+            "Synced scattered files of %s, downloaded %d of %d files with size %d",
+            lang,
+            sum(1 for size in downloaded if size),
+            len(entries),
+            sum(downloaded),
+        )
+        return sum(downloaded)
+
+    async def _sync_entry(
+        self,
+        client: AsyncClient,
+        semaphore: Semaphore,
+        entry: Entry_pkg_version,
+        progress_callback: Callable[[int], None],
+    ):
+        async with semaphore:
+            target = self.game_path / entry.remoteName
+            # hashing runs in a worker thread so the loop keeps the other downloads going
+            if await to_thread(entry.matches, target, self.md5_cache):
+                LOGGER.trace("Scattered file %s is already up to date", target)
+                progress_callback(entry.fileSize)
+                return 0
+            for attempt in range(self.RETRIES):
+                try:
+                    await self._download_entry(client, entry, target, progress_callback)
+                    return entry.fileSize
+                except (HTTPError, ScatteredFileError) as e:
+                    if attempt + 1 == self.RETRIES:
+                        raise
+                    delay = min(2**attempt, self.MAX_BACKOFF)
+                    LOGGER.warning(
+                        "Scattered file %s failed (%s), retrying in %ds",
+                        target,
+                        e,
+                        delay,
+                    )
+                    await sleep(delay)
+            return 0
+
+    async def _download_entry(
+        self,
+        client: AsyncClient,
+        entry: Entry_pkg_version,
+        target: Path,
+        progress_callback: Callable[[int], None],
+    ):
+        url = f"{self.base_url}/{entry.remoteName.as_posix()}"
+        temp = target.with_name(f"{target.name}{self.TEMP_SUFFIX}")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        LOGGER.debug("Downloading scattered file %s to %s", url, target)
+        hasher = md5()
+        size = 0
+        try:
+            async with client.stream("GET", url) as response:
+                response.raise_for_status()
+                with temp.open("wb") as f:
+                    async for chunk in response.aiter_bytes():
+                        if delay := RATE_LIMITS.reserve(IOClass.NETWORK, len(chunk)):
+                            await sleep(delay)
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        size += len(chunk)
+                        progress_callback(len(chunk))
+            if size != entry.fileSize or hasher.hexdigest() != entry.md5:
+                raise ScatteredFileError(
+                    url, entry.fileSize, size, entry.md5, hasher.hexdigest()
+                )
+            # a reader of the game path sees either the old or the new file, never a partial one
+            replace(temp, target)
+            if self.md5_cache is not None:
+                self.md5_cache.put(target, entry.md5)
+        except BaseException:
+            temp.unlink(True)
+            # a retry reports the file again from its start
+            progress_callback(-size)
+            raise
+
+    async def _fetch_bytes(self, client: AsyncClient, name: str):
+        url = f"{self.base_url}/{name}"
+        LOGGER.debug("Fetching %s", url)
+        response = await client.get(url)
+        response.raise_for_status()
+        return response.content
+
+    def _place(self, name: str, content: bytes):
+        target = self.game_path / name
+        temp = target.with_name(f"{target.name}{self.TEMP_SUFFIX}")
+        temp.write_bytes(content)
+        replace(temp, target)
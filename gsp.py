@@ -39,7 +39,9 @@ from rich.progress import (
     TransferSpeedColumn,
 )
 from rich.prompt import Confirm
+from util.batchedprogress import BatchedProgress
 from util.logger import CONSOLE, LOGGER
+from util.ratelimiter import RATE_LIMITS, IOClass
 
 
 class App:
@@ -50,6 +52,15 @@ class App:
 
     def __init__(self):
         self.config = Config(Path("config.txt"))
+        RATE_LIMITS.configure(
+            {
+                IOClass.NETWORK: self.config.bandwidth,
+                IOClass.ARCHIVE_WRITE: self.config.archive_write_limit,
+                IOClass.PATCH_IO: self.config.patch_io_limit,
+            },
+            # edited while running to change the limits
+            self.config.log_path / "gsp_ratelimits.txt",
+        )
         self.progress_elapsed_timer = Progress(
             TextColumn(
                 "[gold3]GSP Project - [progress.description]{task.description} -",
@@ -63,7 +74,8 @@ class App:
         self.progress_elapsed_timer_task = self.progress_elapsed_timer.add_task(
             "Working your magic", start=False, total=None
         )
-        self.progress = Progress(
+        # downloads, extraction and hashing advance it for every chunk, rich only sees the sums
+        self.progress = BatchedProgress(
             TextColumn(
                 "[{task.fields[kolor]}][progress.description]{task.description}",
                 justify="right",
@@ -0,0 +1,176 @@
+import os
+from hashlib import sha1
+from json import dumps, loads
+from pathlib import Path
+from shutil import copyfile
+from threading import Lock
+from time import time
+from typing import Optional
+
+from util.logger import LOGGER
+from util.platformio import PlatformIO
+
+
+class ArchiveCache:
+    def __init__(self, cache_path: Path, max_size: int):
+        self.path = cache_path
+        # 0 means the cache may grow without limit
+        self.max_size = max_size
+        self.objects = cache_path / "objects"
+        self.index_file = cache_path / "index.json"
+        self._lock = Lock()
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.index = self.load_index(self.index_file)
+        LOGGER.info(
+            "Opened archive cache %s with %d archives size %d, limit %d",
+            cache_path,
+            len(self.index["entries"]),
+            self.get_cached_bytes(),
+            max_size,
+        )
+
+    @staticmethod
+    def load_index(index_file: Path) -> dict:
+        try:
+            index = loads(index_file.read_text())
+        except (FileNotFoundError, ValueError):
+            index = {}
+        index.setdefault("entries", {})
+        for counter in ("hits", "misses", "hit_bytes", "evictions", "reclaimed_bytes"):
+            index.setdefault(counter, 0)
+        return index
+
+    @staticmethod
+    def get_key(url: str, md5: Optional[str]):
+        # identical archives are shared whatever url they came from, archives without md5 only by url
+        return md5 if md5 else f"url-{sha1(url.encode()).hexdigest()}"
+
+    def get_cached_bytes(self):
+        return sum(entry["size"] for entry in self.index["entries"].values())
+
+    def fetch(self, url: str, md5: Optional[str], size: int, target: Path):
+        key = self.get_key(url, md5)
+        with self._lock:
+            entry = self.index["entries"].get(key)
+            cached = self.objects / key
+            if entry is None or entry["size"] != size or not cached.exists():
+                if entry is not None:
+                    LOGGER.warning("Dropping stale cached archive %s of %s", key, url)
+                    self._remove(key)
+                self.index["misses"] += 1
+                self._save_index()
+                LOGGER.debug("Archive cache miss %s for %s", key, url)
+                return False
+            target.unlink(True)
+            method = self._link(cached, target)
+            entry["last_used"] = time()
+            self.index["hits"] += 1
+            self.index["hit_bytes"] += size
+            self._save_index()
+        LOGGER.notice(
+            "Archive cache hit %s for %s, %s to %s size %d",
+            key,
+            url,
+            method,
+            target,
+            size,
+        )
+        return True
+
+    def store(self, url: str, md5: Optional[str], file: Path):
+        key = self.get_key(url, md5)
+        size = file.stat().st_size
+        if self.max_size and size > self.max_size:
+            LOGGER.debug(
+                "Not caching %s, size %d is over the cache limit %d",
+                file,
+                size,
+                self.max_size,
+            )
+            return
+        with self._lock:
+            cached = self.objects / key
+            if key not in self.index["entries"] or not cached.exists():
+                temp = cached.with_name(f"{key}.tmp")
+                temp.unlink(True)
+                method = self._link(file, temp)
+                temp.replace(cached)
+                LOGGER.info(
+                    "Cached archive %s from %s as %s by %s", url, file, key, method
+                )
+            self.index["entries"][key] = {
+                "url": url,
+                "md5": md5,
+                "size": size,
+                "last_used": time(),
+            }
+            self._evict(keep=key)
+            self._save_index()
+
+    def _evict(self, keep: str):
+        if not self.max_size:
+            return
+        cached_bytes = self.get_cached_bytes()
+        for key, entry in sorted(
+            self.index["entries"].items(), key=lambda item: item[1]["last_used"]
+        ):
+            if cached_bytes <= self.max_size:
+                break
+            if key == keep:
+                continue
+            LOGGER.verbose(
+                "Evicting cached archive %s of %s size %d, last used %s",
+                key,
+                entry["url"],
+                entry["size"],
+                entry["last_used"],
+            )
+            self._remove(key)
+            cached_bytes -= entry["size"]
+            self.index["evictions"] += 1
+            self.index["reclaimed_bytes"] += entry["size"]
+
+    def _remove(self, key: str):
+        self.index["entries"].pop(key, None)
+        (self.objects / key).unlink(True)
+
+    def _save_index(self):
+        temp = self.index_file.with_name(f"{self.index_file.name}.tmp")
+        temp.write_text(dumps(self.index, indent=1))
+        temp.replace(self.index_file)
+
+    @classmethod
+    def _link(cls, src: Path, dst: Path):
+        # a hardlink or a reflink shares the blocks, only a different volume costs a real copy
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError as e:
+            LOGGER.trace("Can't hardlink %s to %s: %s", src, dst, e)
+        if cls._reflink(src, dst):
+            return "reflink"
+        copyfile(src, dst)
+        return "copy"
+
+    @classmethod
+    def _reflink(cls, src: Path, dst: Path):
+        with src.open("rb") as fsrc, dst.open("wb") as fdst:
+            if PlatformIO.reflink(fsrc, fdst):
+                return True
+        dst.unlink(True)
+        return False
+
+    @classmethod
+    def report(cls, cache_path: Path):
+        index = cls.load_index(cache_path / "index.json")
+        lookups = index["hits"] + index["misses"]
+        return {
+            "archives": len(index["entries"]),
+            "cached_bytes": sum(entry["size"] for entry in index["entries"].values()),
+            "hits": index["hits"],
+            "misses": index["misses"],
+            "hit_ratio": index["hits"] / lookups if lookups else 0.0,
+            "hit_bytes": index["hit_bytes"],
+            "evictions": index["evictions"],
+            "reclaimed_bytes": index["reclaimed_bytes"],
+        }
@@ -0,0 +1,75 @@
+from collections import deque
+from threading import Event, Lock, Thread
+from typing import override
+
+from rich.progress import Progress, TaskID
+from util.logger import LOGGER
+
+
+class BatchedProgress(Progress):
+    # how often the counted advances are handed to rich, the live display refreshes 10 times a second
+    SAMPLE_INTERVAL = 0.1
+
+    def __init__(self, *columns, sample_interval: float = SAMPLE_INTERVAL, **kwargs):
+        super().__init__(*columns, **kwargs)
+        # deque.append is atomic, the hot loops never wait for the lock of rich
+        self._pending: deque[tuple[TaskID, float]] = deque()
+        self._flush_lock = Lock()
+        self._stopped = Event()
+        self._sampler = Thread(
+            target=self._sample,
+            name="ProgressSampler",
+            args=(sample_interval,),
+            daemon=True,
+        )
+        self._sampler.start()
+
+    @override
+    def advance(self, task_id: TaskID, advance: float = 1):
+        self._pending.append((task_id, advance))
+
+    def flush(self):
+        with self._flush_lock:
+            totals: dict[TaskID, float] = {}
+            # only what was there when the flush started, the hot loops keep appending
+            for _ in range(len(self._pending)):
+                task_id, advance = self._pending.popleft()
+                totals[task_id] = totals.get(task_id, 0) + advance
+            for task_id, advance in totals.items():
+                try:
+                    super().advance(task_id, advance)
+                except KeyError:
+                    LOGGER.trace(
+                        "Dropping %d progress of removed task %s", advance, task_id
+                    )
+
+    def _sample(self, interval: float):
+        while not self._stopped.wait(interval):
+            self.flush()
+
+    # advances counted before these have to land first, or they would end up in the reset task
+    @override
+    def update(self, task_id: TaskID, **kwargs):  # type: ignore
+        self.flush()
+        super().update(task_id, **kwargs)
+
+    @override
+    def reset(self, task_id: TaskID, **kwargs):  # type: ignore
+        self.flush()
+        super().reset(task_id, **kwargs)
+
+    @override
+    def stop_task(self, task_id: TaskID):
+        self.flush()
+        super().stop_task(task_id)
+
+    @override
+    def remove_task(self, task_id: TaskID):
+        self.flush()
+        super().remove_task(task_id)
+
+    @override
+    def stop(self):
+        self._stopped.set()
+        self.flush()
+        super().stop()
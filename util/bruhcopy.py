@@ -3,25 +3,24 @@ import stat
 import sys
 from pathlib import Path
 from shutil import *  # type: ignore
-from typing import Callable, Optional
+from typing import Callable, Optional, Sequence
 
-from ntsecuritycon import FILE_READ_ATTRIBUTES, FILE_WRITE_ATTRIBUTES
 from util.logger import LOGGER
-from win32file import (
-    FILE_ATTRIBUTE_NORMAL,
-    FILE_SHARE_DELETE,
-    FILE_SHARE_READ,
-    FILE_SHARE_WRITE,
-    OPEN_EXISTING,
-    CreateFile,
-    GetFileTime,
-    SetFileTime,
-)
+from util.platformio import ZERO_COPY_UNSUPPORTED, PlatformIO
+from util.ratelimiter import RATE_LIMITS, IOClass
 
 
 class BruhCopy:
-    def __init__(self, progress_callback: Callable[[int, int], None]):
+    # tried in order, the first one the filesystems take copies the whole file
+    KERNEL_COPIERS = ("copy_file_range", "sendfile")
+
+    def __init__(
+        self,
+        progress_callback: Callable[[int, int], None],
+        kernel_copiers: Sequence[str] = KERNEL_COPIERS,
+    ):
         self.__progress_callback = progress_callback
+        self.kernel_copiers = kernel_copiers
 
     def bruh_move(
         self,
@@ -32,6 +31,98 @@ class BruhCopy:
     ):
         return self._bruh(src, dst, metadata, delete_metafile, True)
 
+    def bruh_commit(
+        self,
+        src: os.PathLike,
+        dst: os.PathLike,
+        metadata: Optional[os.PathLike],
+        delete_metafile=False,
+        hasher=None,
+    ):
+        # like bruh_move, but the bytes are only copied when src and dst can't share them
+        # hasher takes the committed bytes, hashed tells whether it saw all of them
+        self.hashed = False
+        src = Path(src)
+        # a symlinked file is replaced where the link points to, like copying over it does
+        dst = Path(os.path.realpath(dst))
+        if metadata:
+            # renamed or copied, dst takes these from src
+            copystat(metadata, src)
+            self.copy_timestamps(metadata, src)
+        size = src.stat().st_size
+        method = None
+        if src.stat().st_dev == dst.parent.stat().st_dev:
+            try:
+                os.replace(src, dst)
+                method = "rename"
+            except OSError as e:
+                LOGGER.trace("Can't rename %s to %s: %s", src, dst, e)
+        if method is None:
+            method = self._commit_copy(src, dst, hasher)
+        if method in ("rename", "reflink"):
+            # nothing was written, the progress still counts the file
+            self.__progress_callback(self.COPY_BUFSIZE, size)
+            if hasher is not None:
+                # no bytes passed through python, the committed file is read in place
+                self._hash_file(dst, hasher)
+        self.hashed = hasher is not None and method != "kernel"
+        LOGGER.trace("Committed %s to %s with %s", src, dst, method)
+        if delete_metafile and metadata:
+            Path(metadata).unlink(True)
+        return dst
+
+    def _commit_copy(self, src: Path, dst: Path, hasher=None):
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            if PlatformIO.reflink(fsrc, fdst):
+                method = "reflink"
+            elif name := self._fastcopy_kernel(fsrc, fdst):
+                LOGGER.trace("Copied %s with %s", src, name)
+                method = "kernel"
+            else:
+                self.copyfileobj(fsrc, fdst, hasher=hasher)
+                method = "copy"
+        copystat(src, dst)
+        self.copy_timestamps(src, dst)
+        src.unlink()
+        return method
+
+    def _fastcopy_kernel(self, fsrc, fdst):
+        # the kernel copies without passing the bytes through python, a network share can copy on the server
+        infd, outfd = fsrc.fileno(), fdst.fileno()
+        for name in self.kernel_copiers:
+            # sendfile only writes into regular files on linux
+            if not hasattr(os, name) or name == "sendfile" and sys.platform != "linux":
+                continue
+            offset = 0
+            try:
+                while copied := self._kernel_copy(name, infd, outfd, offset):
+                    self.report_progress(copied)
+                    offset += copied
+            except OSError as e:
+                # a partly copied file can't be finished another way
+                if offset or e.errno not in ZERO_COPY_UNSUPPORTED:
+                    raise
+                LOGGER.trace("Can't %s %s: %s", name, fsrc.name, e)
+                continue
+            size = os.fstat(infd).st_size
+            if offset == size:
+                return name
+            if offset:
+                raise OSError(
+                    f"{name} stopped at {offset} of {size} bytes copying {fsrc.name}"
+                )
+            # some filesystems return 0 for files with data, like fuse mounts and network shares
+            LOGGER.trace("Can't %s %s: nothing was copied", name, fsrc.name)
+        return None
+
+    def _kernel_copy(self, name: str, infd: int, outfd: int, offset: int):
+        if name == "copy_file_range":
+            return os.copy_file_range(
+                infd, outfd, self.KERNEL_COPY_CHUNK, offset, offset
+            )
+        # sendfile continues at the file position of outfd
+        return os.sendfile(outfd, infd, offset, self.KERNEL_COPY_CHUNK)
+
     def bruh_copy(
         self,
         src: os.PathLike,
@@ -63,6 +154,10 @@ class BruhCopy:
 
     _WINDOWS = os.name == "nt"
     COPY_BUFSIZE = 1024 * 1024 if _WINDOWS else 64 * 1024
+    # bytes per copy_file_range or sendfile call, between two progress updates
+    KERNEL_COPY_CHUNK = 64 * 1024 * 1024
+    # md5 releases the gil for buffers this big
+    HASH_BUFSIZE = 1024 * 1024
 
     # def copy2(src, dst, *, follow_symlinks=True):
     def copy2(self, src, dst, metadata=None, *, follow_symlinks=True):
@@ -164,6 +259,10 @@ class BruhCopy:
                         #         return dst
                         #     except _GiveupOnFastCopy:
                         #         pass
+                        # CHANGE
+                        # in chunks, the progress is reported between them
+                        if self._fastcopy_kernel(fsrc, fdst):
+                            return dst
                         # # Windows, see:
                         # # https://github.com/python/cpython/pull/7160#discussion_r195405230
                         # elif _WINDOWS and file_size > 0:
@@ -242,7 +341,7 @@ class BruhCopy:
                     self.report_progress(fdst_write(mv))
 
     # def copyfileobj(fsrc, fdst, length=0):
-    def copyfileobj(self, fsrc, fdst, length=0):
+    def copyfileobj(self, fsrc, fdst, length=0, hasher=None):
         """copy data from file-like object fsrc to file-like object fdst"""
         if not length:
             # length = COPY_BUFSIZE
@@ -251,39 +350,25 @@ class BruhCopy:
         fsrc_read = fsrc.read
         fdst_write = fdst.write
         while buf := fsrc_read(length):
+            # EXTRA
+            if hasher is not None:
+                hasher.update(buf)
             # fdst_write(buf)
             self.report_progress(fdst_write(buf))
 
+    def _hash_file(self, file: Path, hasher):
+        with memoryview(bytearray(self.HASH_BUFSIZE)) as mv, file.open(
+            "rb", buffering=0
+        ) as f:
+            while b := f.readinto(mv):
+                RATE_LIMITS.consume(IOClass.PATCH_IO, b)
+                with mv[:b] as smv:
+                    hasher.update(smv)
+
     def report_progress(self, nbytes):
+        RATE_LIMITS.consume(IOClass.PATCH_IO, nbytes)
         self.__progress_callback(self.COPY_BUFSIZE, nbytes)
 
     @staticmethod
     def copy_timestamps(src, dst):
-        src_handle = CreateFile(
-            src,
-            FILE_READ_ATTRIBUTES,
-            FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE,
-            None,
-            OPEN_EXISTING,
-            FILE_ATTRIBUTE_NORMAL,
-            None,
-        )
-        src_time = GetFileTime(src_handle)  # type: ignore
-        src_handle.close()
-        LOGGER.trace(
-            "Rewriting timestamp %s from file %s to file %s",
-            src_time,
-            src,
-            dst,
-        )
-        dst_handle = CreateFile(
-            dst,
-            FILE_WRITE_ATTRIBUTES,
-            FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE,
-            None,
-            OPEN_EXISTING,
-            FILE_ATTRIBUTE_NORMAL,
-            None,
-        )
-        SetFileTime(dst_handle, *src_time)  # type: ignore
-        dst_handle.close()
+        PlatformIO.copy_timestamps(src, dst)
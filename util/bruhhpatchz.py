@@ -1,11 +1,23 @@
-from asyncio import create_subprocess_exec, run, wait_for
+from asyncio import (
+    all_tasks,
+    create_subprocess_exec,
+    create_task,
+    gather,
+    new_event_loop,
+    run_coroutine_threadsafe,
+    wait,
+)
 from asyncio.subprocess import PIPE
+from concurrent.futures import Future
 from io import BytesIO
 from pathlib import Path
-from typing import Callable, Optional
+from threading import Lock, Thread
+from typing import Any, Callable, Coroutine, Optional, TypeVar
 
 from util.logger import LOGGER
 
+T = TypeVar("T")
+
 
 class HPatchZError(Exception):
     def __init__(
@@ -30,8 +42,53 @@ class HPatchZError(Exception):
         )
 
 
+class HPatchZSupervisor:
+    # one event loop in its own thread runs every hpatchz, instead of a loop built and torn down per file
+    _shared: Optional["HPatchZSupervisor"] = None
+    _shared_lock = Lock()
+
+    def __init__(self):
+        self.loop = new_event_loop()
+        self.thread = Thread(
+            target=self.loop.run_forever, name="HPatchZSupervisor", daemon=True
+        )
+        self.thread.start()
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def submit(self, coroutine: Coroutine[Any, Any, T]) -> Future[T]:
+        return run_coroutine_threadsafe(coroutine, self.loop)
+
+    @classmethod
+    def close_shared(cls):
+        # a later patch starts a new one
+        with cls._shared_lock:
+            shared, cls._shared = cls._shared, None
+        if shared is not None:
+            shared.close()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        # the callbacks left by the last hpatchz, like closing its transports, run before the loop is closed
+        if pending := all_tasks(self.loop):
+            for task in pending:
+                task.cancel()
+            self.loop.run_until_complete(gather(*pending, return_exceptions=True))
+        self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        self.loop.close()
+        LOGGER.debug("Closed hpatchz supervisor")
+
+
 class BruhHPatchZ:
-    STAT_INTERVAL = 1
+    # the new file size is sampled often at first, so small files report progress, then less and less
+    MIN_STAT_INTERVAL = 0.05
+    MAX_STAT_INTERVAL = 1
 
     def __init__(
         self,
@@ -51,7 +108,8 @@ class BruhHPatchZ:
         self.captured_output = BytesIO()
 
     def patch(self):
-        return run(self.subprocess())
+        # the process runs on the shared loop, the calling thread only waits for it
+        return HPatchZSupervisor.shared().submit(self.subprocess()).result()
 
     async def subprocess(self):
         self._hpatchz = await create_subprocess_exec(
@@ -62,90 +120,42 @@ class BruhHPatchZ:
             stdout=PIPE,
             stderr=PIPE,
         )
-        # the subprocess buffers and won't output anything :(
-        # while not (line := await self.subprocess_readline()).startswith(
-        #     "newDataSize : "
-        # ):
-        #     pass
-        # self._expected_size = int(line.split()[-1])
-        # LOGGER.trace(
-        #     "Patching in Subprocess hpatchz reported newDataSize %d",
-        #     self._expected_size,
-        # )
-        return await self.statsize()
-
-    async def statsize(self):
+        # both pipes are drained as hpatchz writes them, it would block on a full one
+        output = gather(
+            self._hpatchz.stdout.read(),  # type: ignore
+            self._hpatchz.stderr.read(),  # type: ignore
+        )
+        exited = create_task(self._hpatchz.wait())
         self._current_size = 0
-        while True:
-            try:
-                new_size = self.new.stat().st_size
-            except FileNotFoundError:
-                LOGGER.trace(
-                    "Patching in Subprocess hpatchz new file %s isn't found yet",
-                    self.new,
-                )
-                new_size = 0
-            self.progress_callback(self.expected_size, new_size - self._current_size)
-            self._current_size = new_size
-            if (
-                self.expected_size is not None
-                and self._current_size >= self.expected_size
-            ):
-                LOGGER.trace(
-                    "Patching in Subprocess hpatchz waiting for exit indefinitely as size expected %d",
-                    self.expected_size,
-                )
-                return_code = await self._hpatchz.wait()
-                break
-            try:
-                LOGGER.trace(
-                    "Patching in Subprocess hpatchz waiting for exit %fs",
-                    self.STAT_INTERVAL,
-                )
-                return_code = await wait_for(self._hpatchz.wait(), self.STAT_INTERVAL)
-                LOGGER.trace(
-                    "Patching in Subprocess hpatchz exited while waiting, return code %d",
-                    return_code,
-                )
-                break
-            except TimeoutError:
-                LOGGER.trace(
-                    "Patching in Subprocess hpatchz waited %fs without exit",
-                    self.STAT_INTERVAL,
-                )
-                await self.subprocess_errored_check()
+        interval = self.MIN_STAT_INTERVAL
+        while not (await wait((exited,), timeout=interval))[0]:
+            self.report_size()
+            interval = min(interval * 2, self.MAX_STAT_INTERVAL)
+        return_code = exited.result()
+        stdout, stderr = await output
+        self.captured_output.write(b"stdout: " + stdout)
+        self.captured_output.write(b"stderr: " + stderr)
         LOGGER.trace("Patching in Subprocess hpatchz exited with code %d", return_code)
-        self.progress_callback(
-            self.expected_size, self.new.stat().st_size - self._current_size
-        )
         if return_code:
-            await self.subprocess_errored_check()
-        return self.new
-
-    async def subprocess_errored_check(self):
-        stderr_test_data = b""
-        try:
-            # try to consume stderr at this point in time
-            stderr_test_data = await wait_for(self._hpatchz.stderr.read(1), 0.1)  # type: ignore
-        except TimeoutError:
-            # no data present in stderr yet
-            pass
-        if stderr_test_data or self._hpatchz.stdout.at_eof() or self._hpatchz.returncode is not None and self._hpatchz.returncode != 0:  # type: ignore
-            # wait for process to end first, then gets all output possible for error reporting
-            await self._hpatchz.wait()
-            self.captured_output.write(b"stdout: " + await self._hpatchz.stdout.read())  # type: ignore
-            self.captured_output.write(b"stderr: " + stderr_test_data + await self._hpatchz.stderr.read())  # type: ignore
             raise HPatchZError(
                 self.hpatchz,
                 self.old,
                 self.diff,
                 self.new,
-                self._hpatchz.returncode,  # type: ignore
+                return_code,
                 self.captured_output.getvalue().decode(errors="replace"),
             )
+        self.report_size()
+        return self.new
 
-    async def subprocess_readline(self) -> str:
-        await self.subprocess_errored_check()
-        line = await self._hpatchz.stdout.readline()  # type: ignore
-        self.captured_output.write(b"stdout: " + line)
-        return line.decode(errors="replace").strip()
+    def report_size(self):
+        try:
+            new_size = self.new.stat().st_size
+        except FileNotFoundError:
+            LOGGER.trace(
+                "Patching in Subprocess hpatchz new file %s isn't found yet",
+                self.new,
+            )
+            new_size = 0
+        self.progress_callback(self.expected_size, new_size - self._current_size)
+        self._current_size = new_size
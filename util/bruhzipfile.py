@@ -1,27 +1,37 @@
 import os
+import sys
+from hashlib import md5
+from io import BufferedReader
 from pathlib import Path
 from struct import unpack
 from time import mktime
-from typing import Callable, override
-from zipfile import ZipFile, ZipInfo
+from typing import BinaryIO, Callable, Optional, override
+from zipfile import (
+    _FH_EXTRA_FIELD_LENGTH,
+    _FH_FILENAME_LENGTH,
+    _FH_SIGNATURE,
+    ZIP_STORED,
+    BadZipFile,
+    ZipFile,
+    ZipInfo,
+    sizeFileHeader,
+    stringFileHeader,
+    structFileHeader,
+)
+from zlib import crc32
 
-from ntsecuritycon import FILE_WRITE_ATTRIBUTES
-from pywintypes import TimeStamp
-from split_file_reader import SplitFileReader
 from util.logger import LOGGER
-from win32file import (
-    FILE_ATTRIBUTE_NORMAL,
-    FILE_SHARE_DELETE,
-    FILE_SHARE_READ,
-    FILE_SHARE_WRITE,
-    OPEN_EXISTING,
-    CreateFile,
-    SetFileTime,
-)
+from util.platformio import ZERO_COPY_UNSUPPORTED, PlatformIO
+from util.ratelimiter import RATE_LIMITS, IOClass
+from util.splitreader import SplitReader
+from util.writeverifier import WriteVerifier
+from util.zipindex import ZipIndex
 
 # Copied from zipfile.py
 _WINDOWS = os.name == "nt"
 COPY_BUFSIZE = 1024 * 1024 if _WINDOWS else 64 * 1024
+# stored members are copied and checksummed in pieces this big
+STORED_CHUNK = 8 * 1024 * 1024
 
 
 class BruhZipFile(ZipFile):
@@ -30,20 +40,69 @@ class BruhZipFile(ZipFile):
         self,
         file: Path | list[Path],
         progress_callback: Callable[[ZipInfo, int], None],
+        index: Optional[ZipIndex] = None,
+        read_ahead: int = 0,
+        write_verifier: Optional[WriteVerifier] = None,
     ):
-        if isinstance(file, list):
-            self.split_file_reader = SplitFileReader(file)
-            super().__init__(self.split_file_reader)  # type: ignore
+        # the members are taken from the index instead of the central directory
+        self.index = index
+        # pkg_version files are hashed as they are extracted
+        self.write_verifier = write_verifier
+        self.file = file
+        self.read_ahead = read_ahead
+        # the parts of the archive for copying stored members, shared with zipfile for split archives
+        self._stored_reader: Optional[SplitReader] = None
+        # tried in order, the ones that fail as unsupported are dropped
+        self._copiers: list[Callable[[int, int, int, int], int]] = []
+        if hasattr(os, "copy_file_range"):
+            self._copiers.append(self._copy_file_range)
+        # sendfile only writes into regular files on linux
+        if sys.platform == "linux":
+            self._copiers.append(self._sendfile)
+        self.split_reader = (
+            SplitReader(file, bool(read_ahead)) if isinstance(file, list) else None
+        )
+        self.read_ahead_reader = None
+        if read_ahead:
+            # the small reads of ZipExtFile are served from few long reads, a rotational disk seeks less
+            raw = self.split_reader or open(file, "rb", buffering=0)  # type: ignore
+            if self.split_reader is None:
+                PlatformIO.advise_sequential(raw.fileno())
+            self.read_ahead_reader = BufferedReader(raw, read_ahead)  # type: ignore
+            super().__init__(self.read_ahead_reader)
+        elif self.split_reader is not None:
+            super().__init__(self.split_reader)  # type: ignore
         else:
-            self.split_file_reader = None
             super().__init__(file)
         self.progress_callback = progress_callback
 
+    @override
+    def _RealGetContents(self):
+        if self.index is None:
+            return super()._RealGetContents()  # type: ignore
+        self.index.fill(self)
+
+    def reopen(self):
+        # another handle on the same archive for another thread, its members aren't parsed again
+        return BruhZipFile(
+            self.file,
+            self.progress_callback,
+            self.index or ZipIndex.from_zipfile(self, self.file, "", {}),
+            self.read_ahead,
+            self.write_verifier,
+        )
+
     @override
     def close(self):
         super().close()
-        if self.split_file_reader is not None:
-            self.split_file_reader.close()
+        # a passed file isn't closed by ZipFile
+        if self.read_ahead_reader is not None:
+            self.read_ahead_reader.close()
+        if self.split_reader is not None:
+            self.split_reader.close()
+        elif self._stored_reader is not None:
+            self._stored_reader.close()
+        self._stored_reader = None
 
     # copied from zipfile.py
     @override
@@ -77,26 +136,126 @@ class BruhZipFile(ZipFile):
         # Create all upper directories if necessary.
         upperdirs = os.path.dirname(targetpath)
         if upperdirs and not os.path.exists(upperdirs):
-            os.makedirs(upperdirs)
+            # CHANGE
+            # another extraction thread can create the same directory in between
+            os.makedirs(upperdirs, exist_ok=True)
 
         if member.is_dir():
             if not os.path.isdir(targetpath):
-                os.mkdir(targetpath)
+                # CHANGE
+                os.makedirs(targetpath, exist_ok=True)
             return targetpath
 
-        with self.open(member, pwd=pwd) as source, open(targetpath, "wb") as target:
-            # shutil.copyfileobj(source, target)
-            # CHANGE
-            self._copyfileobj(source, target, member)
-            # EXTRA
-            self._write_timestamps(targetpath, self._get_timestamps(member), member)
+        # EXTRA
+        hasher = (
+            md5()
+            if self.write_verifier is not None
+            and self.write_verifier.wants(member.filename)
+            else None
+        )
+        if self._is_plain_stored(member):
+            with open(targetpath, "wb", buffering=0) as target:
+                self._extract_stored(member, target, hasher)
+                self._write_timestamps(targetpath, self._get_timestamps(member), member)
+        else:
+            with self.open(member, pwd=pwd) as source, open(targetpath, "wb") as target:
+                # shutil.copyfileobj(source, target)
+                # CHANGE
+                self._copyfileobj(source, target, member, hasher=hasher)
+                # EXTRA
+                # a buffered tail written on close would stamp the file with the current time again
+                target.flush()
+                self._write_timestamps(targetpath, self._get_timestamps(member), member)
+        if hasher is not None:
+            self.write_verifier.check(member.filename, hasher.hexdigest())  # type: ignore
 
         return targetpath
 
+    @staticmethod
+    def _is_plain_stored(member: ZipInfo):
+        # encrypted members have to go through the decrypter of ZipExtFile
+        return member.compress_type == ZIP_STORED and not member.flag_bits & 0x1
+
+    def _get_stored_reader(self):
+        if self._stored_reader is None:
+            self._stored_reader = self.split_reader or SplitReader(
+                [self.file], bool(self.read_ahead)  # type: ignore
+            )
+        return self._stored_reader
+
+    def _extract_stored(self, member: ZipInfo, target: BinaryIO, hasher=None):
+        # the data starts after the local header, whose name and extra field can differ from the central directory
+        reader = self._get_stored_reader()
+        header = reader.pread(sizeFileHeader, member.header_offset)
+        if len(header) != sizeFileHeader:
+            raise BadZipFile("Truncated file header")
+        fheader = unpack(structFileHeader, header)
+        if fheader[_FH_SIGNATURE] != stringFileHeader:
+            raise BadZipFile("Bad magic number for file header")
+        offset = (
+            member.header_offset
+            + sizeFileHeader
+            + fheader[_FH_FILENAME_LENGTH]
+            + fheader[_FH_EXTRA_FIELD_LENGTH]
+        )
+        LOGGER.trace(
+            "Copying stored file %s at offset %d size %d",
+            member.filename,
+            offset,
+            member.compress_size,
+        )
+        crc = 0
+        copied = 0
+        for part, start, length in reader.spans(offset, member.compress_size):
+            mm = reader.map(part)
+            for pos in range(start, start + length, STORED_CHUNK):
+                n = min(STORED_CHUNK, start + length - pos)
+                RATE_LIMITS.consume(IOClass.PATCH_IO, n)
+                # the checksum reads the mapped pages the copy is about to take from the page cache
+                with memoryview(mm)[pos : pos + n] as view:  # type: ignore
+                    crc = crc32(view, crc)
+                    if hasher is not None:
+                        hasher.update(view)
+                    self._copy_range(reader.fileno_of(part), target.fileno(), pos, view)
+                self.progress_callback(member, n)
+            copied += length
+        if copied != member.compress_size:
+            raise BadZipFile("Truncated file")
+        if crc != member.CRC:
+            raise BadZipFile(f"Bad CRC-32 for file {member.filename!r}")
+
+    def _copy_range(self, src: int, dst: int, offset: int, view: memoryview):
+        # both zero copy calls and the write continue at the file position of dst
+        done = 0
+        while self._copiers and done < len(view):
+            try:
+                copied = self._copiers[0](src, dst, offset + done, len(view) - done)
+            except OSError as e:
+                if e.errno not in ZERO_COPY_UNSUPPORTED:
+                    raise
+                LOGGER.debug(
+                    "Can't use %s, falling back: %s", self._copiers[0].__name__, e
+                )
+                self._copiers.pop(0)
+                continue
+            if not copied:
+                break
+            done += copied
+        while done < len(view):
+            done += os.write(dst, view[done:])
+
+    @staticmethod
+    def _copy_file_range(src: int, dst: int, offset: int, count: int):
+        return os.copy_file_range(src, dst, count, offset)
+
+    @staticmethod
+    def _sendfile(src: int, dst: int, offset: int, count: int):
+        return os.sendfile(dst, src, offset, count)
+
     # copied from shutil.py
     # CHANGE
     # def copyfileobj(fsrc, fdst, length=0):
-    def _copyfileobj(self, fsrc, fdst, fzip, length=0):
+    def _copyfileobj(self, fsrc, fdst, fzip, length=0, hasher=None):
         """copy data from file-like object fsrc to file-like object fdst"""
         # Localize variable access to minimize overhead.
         if not length:
@@ -109,6 +268,10 @@ class BruhZipFile(ZipFile):
                 break
             # fdst_write(buf)
             # CHANGE
+            RATE_LIMITS.consume(IOClass.PATCH_IO, len(buf))
+            # EXTRA
+            if hasher is not None:
+                hasher.update(buf)
             self.progress_callback(fzip, fdst_write(buf))
 
     # Bing Chat answer
@@ -172,25 +335,17 @@ class BruhZipFile(ZipFile):
             )
             os.utime(targetpath, dt)
             return
-        mactime = {mac: TimeStamp(stamp) for mac, stamp in mactime.items()}
+        mactime = {
+            mac: PlatformIO.filetime_to_ns(stamp) for mac, stamp in mactime.items()
+        }
         LOGGER.trace(
-            "Writing timestamp winapi method for file %s time %s",
+            "Writing timestamp ns method for file %s time %s",
             targetpath,
             mactime,
         )
-        handle = CreateFile(
-            targetpath,
-            FILE_WRITE_ATTRIBUTES,
-            FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE,
-            None,
-            OPEN_EXISTING,
-            FILE_ATTRIBUTE_NORMAL,
-            None,
-        )
-        SetFileTime(
-            handle, mactime["ctime"], mactime["atime"], mactime["mtime"]  # type:ignore
+        PlatformIO.set_timestamps(
+            targetpath, mactime["atime"], mactime["mtime"], mactime["ctime"]
         )
-        handle.close()
 
 
 # if __name__ == '__main__':
@@ -0,0 +1,42 @@
+from concurrent.futures import FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
+from typing import Callable, TypeVar
+
+from util.logger import LOGGER
+
+T = TypeVar("T")
+
+
+class DownloadScheduler:
+    def __init__(self, concurrency: int):
+        self.concurrency = max(1, concurrency)
+        # a single worker runs the jobs in submission order, same as downloading one after another
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="Download"
+        )
+        self._futures: list[Future] = []
+
+    def submit(self, job: Callable[[], T], on_done: Callable[[T], None]):
+        # on_done runs on the worker right after its job, so a finished archive doesn't wait for the others
+        def run():
+            result = job()
+            on_done(result)
+            return result
+
+        future = self._executor.submit(run)
+        self._futures.append(future)
+        LOGGER.trace(
+            "Scheduled download job %s, %d jobs, concurrency %d",
+            job,
+            len(self._futures),
+            self.concurrency,
+        )
+        return future
+
+    def join(self):
+        done, not_done = wait(self._futures, return_when=FIRST_EXCEPTION)
+        for future in not_done:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        for future in done:
+            # raises the exception of a failed job
+            future.result()
@@ -0,0 +1,82 @@
+from threading import Lock
+from weakref import WeakSet
+
+from httpx import AsyncClient, Client, Limits, Response, Timeout
+from util.logger import LOGGER
+
+
+class ClientManager:
+    # idle connections are kept this long for the next archive or segment
+    KEEPALIVE_EXPIRY = 60
+    TIMEOUT = Timeout(30, connect=10)
+
+    def __init__(self, max_connections: int, http2: bool = True):
+        self.http2 = http2
+        self.new_connections = 0
+        self.reused_connections = 0
+        self._seen_streams: WeakSet = WeakSet()
+        self._lock = Lock()
+        self.client = Client(
+            http2=http2,
+            limits=Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=self.KEEPALIVE_EXPIRY,
+            ),
+            timeout=self.TIMEOUT,
+            follow_redirects=True,
+            event_hooks={"response": [self._count_connection]},
+        )
+        LOGGER.debug(
+            "Init ClientManager: http2 %s max connections %d",
+            http2,
+            max_connections,
+        )
+
+    @classmethod
+    def create_async_client(cls, max_connections: int, http2: bool = True):
+        # same pool settings for the asyncio based downloads, owned by their event loop
+        return AsyncClient(
+            http2=http2,
+            limits=Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=cls.KEEPALIVE_EXPIRY,
+            ),
+            timeout=cls.TIMEOUT,
+            follow_redirects=True,
+        )
+
+    def _count_connection(self, response: Response):
+        # every response carries the network stream of the connection that served it
+        stream = response.extensions.get("network_stream")
+        if stream is None:
+            return
+        with self._lock:
+            if stream in self._seen_streams:
+                self.reused_connections += 1
+            else:
+                self._seen_streams.add(stream)
+                self.new_connections += 1
+        LOGGER.trace(
+            "Response %s %s over %s, connections new %d reused %d",
+            response.http_version,
+            response.url,
+            stream,
+            self.new_connections,
+            self.reused_connections,
+        )
+
+    def close(self):
+        self.client.close()
+        LOGGER.info(
+            "Closed http client: %d requests reused a connection, %d opened a new one",
+            self.reused_connections,
+            self.new_connections,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
@@ -0,0 +1,83 @@
+from hashlib import file_digest
+from json import dumps, loads
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+
+from util.logger import LOGGER
+
+
+class Md5Cache:
+    # md5 of installed files, trusted as long as their size and mtime stay the same
+    def __init__(self, cache_file: Path):
+        self.cache_file = cache_file
+        self._lock = Lock()
+        self._entries: dict[str, tuple[int, int, str]] = self._load(cache_file)
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _load(cache_file: Path):
+        try:
+            entries = {
+                file: (size, mtime_ns, md5)
+                for file, (size, mtime_ns, md5) in loads(
+                    cache_file.read_text(encoding="utf-8")
+                ).items()
+            }
+        except FileNotFoundError:
+            return {}
+        except (ValueError, TypeError) as e:
+            LOGGER.warning("Ignoring broken md5 cache %s: %s", cache_file, e)
+            return {}
+        LOGGER.debug("Loaded md5 cache %s with %d files", cache_file, len(entries))
+        return entries
+
+    def md5(self, file: Path) -> Optional[str]:
+        try:
+            stat = file.stat()
+        except FileNotFoundError:
+            return None
+        key = str(file)
+        with self._lock:
+            cached = self._entries.get(key)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            self.hits += 1
+            return cached[2]
+        self.misses += 1
+        with file.open("rb") as f:
+            md5 = file_digest(f, "md5").hexdigest()
+        with self._lock:
+            self._entries[key] = (stat.st_size, stat.st_mtime_ns, md5)
+            self._dirty = True
+        return md5
+
+    def put(self, file: Path, md5: str):
+        # for a file whose md5 was already computed elsewhere, like the verify step
+        stat = file.stat()
+        with self._lock:
+            self._entries[str(file)] = (stat.st_size, stat.st_mtime_ns, md5)
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            text = dumps(self._entries)
+            self._dirty = False
+        temp = self.cache_file.with_name(f"{self.cache_file.name}.tmp")
+        try:
+            temp.write_text(text, encoding="utf-8")
+            temp.replace(self.cache_file)
+        except OSError as e:
+            # only a later run hashes again
+            LOGGER.warning("Can't save md5 cache %s: %s", self.cache_file, e)
+            return
+        LOGGER.debug(
+            "Saved md5 cache %s with %d files, %d hits %d misses",
+            self.cache_file,
+            len(self._entries),
+            self.hits,
+            self.misses,
+        )
@@ -0,0 +1,84 @@
+import os
+from json import dumps, loads
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+
+from game.gamelanguage import GameLanguage
+from setuptools._vendor.packaging import version as semver
+from util.logger import LOGGER
+
+
+class PatchJournal:
+    STEP_DELETE = "delete"
+    STEP_EXTRACT = "extract"
+    STEP_PATCH = "patch"
+    STEP_VERIFY = "verify"
+
+    def __init__(self, journal_file: Path):
+        self.file = journal_file
+        self.done = self.replay(journal_file)
+        self._lock = Lock()
+        self._journal = journal_file.open("a", encoding="utf-8")
+        if self._ends_cut_short(journal_file):
+            # start on a fresh line instead of appending to the broken one
+            self._journal.write("\n")
+        LOGGER.info(
+            "Opened patch journal %s, %d finished entries replayed",
+            journal_file,
+            sum(len(files) for files in self.done.values()),
+        )
+
+    @staticmethod
+    def replay(journal_file: Path):
+        done: dict[str, set[str]] = {}
+        try:
+            with journal_file.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = loads(line)
+                    except ValueError:
+                        # the last line can be cut short by a crash
+                        LOGGER.debug("Ignoring broken journal line %r", line)
+                        continue
+                    done.setdefault(record["step"], set()).add(record["file"])
+        except FileNotFoundError:
+            pass
+        return done
+
+    @staticmethod
+    def _ends_cut_short(journal_file: Path):
+        with journal_file.open("rb") as f:
+            if f.seek(0, os.SEEK_END) == 0:
+                return False
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+
+    def is_done(self, step: str, file: str):
+        return file in self.done.get(step, ())
+
+    def record(self, step: str, file: str):
+        with self._lock:
+            # flushed right away so a crash loses at most the file being worked on
+            self._journal.write(dumps({"step": step, "file": file}) + "\n")
+            self._journal.flush()
+            self.done.setdefault(step, set()).add(file)
+
+    def sync(self):
+        with self._lock:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+    def close(self, finished: bool = False):
+        self._journal.close()
+        if finished:
+            LOGGER.info("Patch journal %s finished, removing it", self.file)
+            self.file.unlink(True)
+
+    @staticmethod
+    def journal_file(
+        log_path: Path,
+        lang: GameLanguage,
+        version: tuple[Optional[semver.Version], semver.Version],
+    ):
+        return log_path / f"gsp_journal_{lang}_{version[0]}_{version[1]}.jsonl"
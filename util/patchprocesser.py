@@ -1,19 +1,30 @@
+from concurrent.futures import FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from hashlib import md5 as md5hasher
+from itertools import zip_longest
 from pathlib import Path
 from sys import getsizeof
+from threading import Lock, Semaphore, local
 from types import SimpleNamespace
-from typing import Collection
+from typing import Collection, Optional
 from zipfile import ZipInfo
 
 from game.gameinfo import GameInfo
 from game.gamelanguage import GameLanguage
-from game.gameutil import Entry_pkg_version
+from game.gameutil import CompactManifest, Entry_pkg_version
 from rich.progress import Progress, TaskID
 from setuptools._vendor.packaging import version as semver
 from util.bruhcopy import BruhCopy
 from util.bruhhpatchz import BruhHPatchZ
 from util.bruhzipfile import BruhZipFile
 from util.logger import LOGGER
+from util.md5cache import Md5Cache
+from util.patchjournal import PatchJournal
+from util.platformio import WINDOWS, PlatformIO
+from util.ratelimiter import RATE_LIMITS, IOClass
+from util.spacebudget import SpaceBudget
+from util.writeverifier import WriteVerifier
+from util.zipindex import ZipIndex
 
 
 class PatchProcesser:
@@ -22,6 +33,8 @@ class PatchProcesser:
     STEPN_EXTRACT_INPKG = 3
     STEPN_PATCH_HDIFF = 4
     STEPN_VERIFY = 5
+    # md5 releases the gil for buffers this big, the verify workers hash side by side
+    VERIFY_BUFSIZE = 1024 * 1024
 
     @staticmethod
     def step_move_audioassests_from_persistent_to_streamingassets(
@@ -71,6 +84,7 @@ class PatchProcesser:
         files: Collection[Path],
         progress: Progress,
         taskid: TaskID,
+        journal: Optional[PatchJournal] = None,
     ):
         LOGGER.notice(
             "Patching %s step %d: Delete files in deletefiles.txt from %s",
@@ -79,17 +93,30 @@ class PatchProcesser:
             delete_in,
         )
         progress.update(taskid, description="Extra deleting", lang=lang)
-        PatchProcesser._delete_files(delete_in, files, progress, taskid)
+        PatchProcesser._delete_files(delete_in, files, progress, taskid, journal)
 
     @staticmethod
     def _delete_files(
-        delete_in: Path, files: Collection[Path], progress: Progress, taskid: TaskID
+        delete_in: Path,
+        files: Collection[Path],
+        progress: Progress,
+        taskid: TaskID,
+        journal: Optional[PatchJournal] = None,
     ):
         for file in files:
             to_delete = delete_in / file
-            LOGGER.debug("Deleting file %s", to_delete)
-            to_delete.unlink(True)
+            if journal is not None and journal.is_done(
+                PatchJournal.STEP_DELETE, file.as_posix()
+            ):
+                LOGGER.trace("Journal skipping deleted file %s", to_delete)
+            else:
+                LOGGER.debug("Deleting file %s", to_delete)
+                to_delete.unlink(True)
+                if journal is not None:
+                    journal.record(PatchJournal.STEP_DELETE, file.as_posix())
             progress.advance(taskid, getsizeof(str(to_delete)))
+        if journal is not None:
+            journal.sync()
 
     @staticmethod
     def step_extract_files(
@@ -103,17 +130,48 @@ class PatchProcesser:
         hpatchz_dir: Path,
         progress: Progress,
         taskid: TaskID,
+        journal: Optional[PatchJournal] = None,
+        index: Optional[ZipIndex] = None,
+        workers: int = 1,
+        read_ahead: int = 0,
+        patch_workers: int = 1,
+        patch_budget: int = 0,
+        pkg_version: Optional[CompactManifest] = None,
+        write_verifier: Optional[WriteVerifier] = None,
+        archive_order: bool = False,
     ):
         with BruhZipFile(
-            update_file, lambda _, step: progress.advance(taskid, step)
+            update_file,
+            lambda _, step: progress.advance(taskid, step),
+            index,
+            read_ahead,
+            write_verifier,
         ) as zf:
+            # opt in, the single pass is only faster where the archive sits on a rotational disk
+            if archive_order and workers <= 1:
+                progress.update(taskid, description="Extracting", lang=lang)
+                PatchProcesser._step_extract_and_patch_in_order(
+                    extract_to,
+                    lang,
+                    zf,
+                    standalone_file_list,
+                    inpkg_file_list,
+                    patching_file_list,
+                    temp_dir,
+                    hpatchz_dir,
+                    journal,
+                    patch_workers,
+                    patch_budget,
+                    pkg_version,
+                )
+                return
             progress.update(taskid, description="Std extracting", lang=lang)
             PatchProcesser._step_extract_standalone_files(
-                extract_to, lang, zf, standalone_file_list
+                extract_to, lang, zf, standalone_file_list, journal, workers
             )
             progress.update(taskid, description="Pkg extracting", lang=lang)
             PatchProcesser._step_extract_inpkg_files(
-                extract_to, lang, zf, inpkg_file_list
+                extract_to, lang, zf, inpkg_file_list, journal, workers
             )
             progress.update(taskid, description="Hdiff patching", lang=lang)
             PatchProcesser._step_patch_files_in_hdifffiles_txt(
@@ -123,14 +181,105 @@ class PatchProcesser:
                 patching_file_list,
                 temp_dir,
                 hpatchz_dir,
+                journal,
+                patch_workers,
+                patch_budget,
+                pkg_version,
             )
 
+    @staticmethod
+    def plan_reads(*infolists: Collection[ZipInfo]):
+        # the members of all lists in the order they are stored, so the archive is read front to back
+        return sorted(
+            (
+                (kind, info)
+                for kind, infolist in enumerate(infolists)
+                for info in infolist
+            ),
+            key=lambda planned: planned[1].header_offset,
+        )
+
+    @staticmethod
+    def _step_extract_and_patch_in_order(
+        extract_to: Path,
+        lang: GameLanguage,
+        update_file: BruhZipFile,
+        standalone_file_list: Collection[ZipInfo],
+        inpkg_file_list: Collection[ZipInfo],
+        patching_file_list: Collection[ZipInfo],
+        temp_dir: Path,
+        hpatchz_dir: Path,
+        journal: Optional[PatchJournal] = None,
+        patch_workers: int = 1,
+        patch_budget: int = 0,
+        pkg_version: Optional[CompactManifest] = None,
+    ):
+        hpatchzexe = PatchProcesser._get_hpatchzexe(hpatchz_dir)
+        LOGGER.notice(
+            "Patching %s steps %d-%d: Extract standalone and inpkg files and patch hdiff files from update file %s to %s in archive order. Expecting hpatchzexe at %s",
+            lang,
+            PatchProcesser.STEPN_EXTRACT_STANDALONE,
+            PatchProcesser.STEPN_PATCH_HDIFF,
+            update_file.filename,
+            extract_to,
+            hpatchzexe,
+        )
+        # an old file that the archive also carries is only patched after it is extracted
+        extracted = {info.filename for info in standalone_file_list} | {
+            info.filename for info in inpkg_file_list
+        }
+        in_pass: list[ZipInfo] = []
+        deferred: list[ZipInfo] = []
+        for info in patching_file_list:
+            # the pool runs after the pass, not in between of its reads
+            if (
+                patch_workers > 1
+                or Path(info.filename).with_suffix("").as_posix() in extracted
+            ):
+                deferred.append(info)
+            else:
+                in_pass.append(info)
+        patched_sizes = PatchProcesser._get_patched_sizes(
+            patching_file_list, pkg_version
+        )
+        for kind, info in PatchProcesser.plan_reads(
+            [*standalone_file_list, *inpkg_file_list], in_pass
+        ):
+            if kind == 0:
+                if not PatchProcesser._skip_extracted(update_file, info, journal):
+                    PatchProcesser._extract_file(update_file, info, extract_to, journal)
+            elif not PatchProcesser._skip_patched(update_file, info, journal):
+                PatchProcesser._patch_file(
+                    extract_to,
+                    update_file,
+                    info,
+                    temp_dir,
+                    hpatchzexe,
+                    journal,
+                    patched_sizes.get(info.filename),
+                )
+        PatchProcesser._patch_files(
+            extract_to,
+            update_file,
+            deferred,
+            temp_dir,
+            hpatchzexe,
+            journal,
+            patch_workers,
+            patch_budget,
+            patched_sizes,
+        )
+        if journal is not None:
+            journal.sync()
+
     @staticmethod
     def _step_extract_standalone_files(
         extract_to: Path,
         lang: GameLanguage,
         update_file: BruhZipFile,
         file_list: Collection[ZipInfo],
+        journal: Optional[PatchJournal] = None,
+        workers: int = 1,
     ):
         LOGGER.notice(
             "Patching %s step %d: Extract standalone files from update file %s to %s",
@@ -139,7 +288,9 @@ class PatchProcesser:
             update_file.filename,
             extract_to,
         )
-        PatchProcesser._extract_files(update_file, file_list, extract_to)
+        PatchProcesser._extract_files(
+            update_file, file_list, extract_to, journal, workers
+        )
 
     @staticmethod
     def _step_extract_inpkg_files(
@@ -147,6 +298,8 @@ class PatchProcesser:
         lang: GameLanguage,
         update_file: BruhZipFile,
         file_list: Collection[ZipInfo],
+        journal: Optional[PatchJournal] = None,
+        workers: int = 1,
     ):
         LOGGER.notice(
             "Patching %s step %d: Extract inpkg files from update file %s to %s",
@@ -155,21 +308,118 @@ class PatchProcesser:
             update_file.filename,
             extract_to,
         )
-        PatchProcesser._extract_files(update_file, file_list, extract_to)
+        PatchProcesser._extract_files(
+            update_file, file_list, extract_to, journal, workers
+        )
 
     @staticmethod
     def _extract_files(
         zf: BruhZipFile,
         infolist: Collection[ZipInfo],
         extract_to: Path,
+        journal: Optional[PatchJournal] = None,
+        workers: int = 1,
     ):
-        for info in infolist:
-            LOGGER.debug(
-                "Extracting file %s to %s",
-                info.filename,
-                extract_to / info.filename,
+        pending = [
+            info
+            for info in infolist
+            if not PatchProcesser._skip_extracted(zf, info, journal)
+        ]
+        if workers > 1 and len(pending) > 1:
+            PatchProcesser._extract_files_parallel(
+                zf, pending, extract_to, journal, workers
             )
-            zf.extract(info, extract_to)
+        else:
+            for _, info in PatchProcesser.plan_reads(pending):
+                PatchProcesser._extract_file(zf, info, extract_to, journal)
+        if journal is not None:
+            journal.sync()
+
+    @staticmethod
+    def _skip_extracted(
+        zf: BruhZipFile, info: ZipInfo, journal: Optional[PatchJournal] = None
+    ):
+        if journal is None or not journal.is_done(
+            PatchJournal.STEP_EXTRACT, info.filename
+        ):
+            return False
+        LOGGER.trace("Journal skipping extracted file %s", info.filename)
+        zf.progress_callback(info, info.file_size)
+        return True
+
+    @staticmethod
+    def _extract_file(
+        zf: BruhZipFile,
+        info: ZipInfo,
+        extract_to: Path,
+        journal: Optional[PatchJournal] = None,
+    ):
+        LOGGER.debug(
+            "Extracting file %s to %s",
+            info.filename,
+            extract_to / info.filename,
+        )
+        zf.extract(info, extract_to)
+        if journal is not None:
+            journal.record(PatchJournal.STEP_EXTRACT, info.filename)
+
+    @staticmethod
+    def _extract_files_parallel(
+        zf: BruhZipFile,
+        infolist: list[ZipInfo],
+        extract_to: Path,
+        journal: Optional[PatchJournal],
+        workers: int,
+    ):
+        LOGGER.debug(
+            "Extracting %d files to %s with %d workers",
+            len(infolist),
+            extract_to,
+            workers,
+        )
+        with PatchProcesser._worker_handles(zf) as get_handle, ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="Extract"
+        ) as executor:
+            # the biggest files first, so no worker is left with a long one at the end
+            futures = [
+                executor.submit(
+                    lambda info: PatchProcesser._extract_file(
+                        get_handle(), info, extract_to, journal
+                    ),
+                    info,
+                )
+                for info in sorted(
+                    infolist, key=lambda info: info.file_size, reverse=True
+                )
+            ]
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in not_done:
+                future.cancel()
+            for future in done:
+                # raises the exception of a failed extraction
+                future.result()
+
+    @staticmethod
+    @contextmanager
+    def _worker_handles(zf: BruhZipFile):
+        # a ZipFile handle has one file position, so every worker thread reads through its own
+        handles: list[BruhZipFile] = []
+        handles_lock = Lock()
+        worker = local()
+
+        def get_handle():
+            handle = getattr(worker, "handle", None)
+            if handle is None:
+                handle = worker.handle = zf.reopen()
+                with handles_lock:
+                    handles.append(handle)
+            return handle
+
+        try:
+            yield get_handle
+        finally:
+            for handle in handles:
+                handle.close()
 
     @staticmethod
     def _step_patch_files_in_hdifffiles_txt(
@@ -179,8 +429,12 @@ class PatchProcesser:
         file_list: Collection[ZipInfo],
         temp_dir: Path,
         hpatchz_dir: Path,
+        journal: Optional[PatchJournal] = None,
+        workers: int = 1,
+        budget: int = 0,
+        pkg_version: Optional[CompactManifest] = None,
     ):
-        hpatchzexe = hpatchz_dir / "hpatchz.exe"
+        hpatchzexe = PatchProcesser._get_hpatchzexe(hpatchz_dir)
         LOGGER.notice(
             "Patching %s step %d: Patch hdiff files from update file %s to %s. Expecting hpatchzexe at %s",
             lang,
@@ -189,46 +443,220 @@ class PatchProcesser:
             patch_to,
             hpatchzexe,
         )
-        for info in file_list:
-            LOGGER.debug(
-                "Extracting hdiff patch file %s to %s",
-                info.filename,
-                temp_dir / info.filename,
+        PatchProcesser._patch_files(
+            patch_to,
+            update_file,
+            file_list,
+            temp_dir,
+            hpatchzexe,
+            journal,
+            workers,
+            budget,
+            PatchProcesser._get_patched_sizes(file_list, pkg_version),
+        )
+        if journal is not None:
+            journal.sync()
+
+    @staticmethod
+    def _get_hpatchzexe(hpatchz_dir: Path):
+        return hpatchz_dir / ("hpatchz.exe" if WINDOWS else "hpatchz")
+
+    @staticmethod
+    def _get_patched_sizes(
+        infolist: Collection[ZipInfo], pkg_version: Optional[CompactManifest] = None
+    ):
+        # the size of the file hpatchz writes, from the manifest of the new version
+        if pkg_version is None:
+            return {}
+        in_manifest = pkg_version.lookup(
+            [Path(info.filename).with_suffix("").as_posix() for info in infolist]
+        )
+        return {
+            info.filename: pkg_version.sizes[entry]
+            for info, entry in zip(infolist, in_manifest)
+            if entry >= 0
+        }
+
+    @staticmethod
+    def _patch_files(
+        patch_to: Path,
+        update_file: BruhZipFile,
+        infolist: Collection[ZipInfo],
+        temp_dir: Path,
+        hpatchzexe: Path,
+        journal: Optional[PatchJournal],
+        workers: int,
+        budget: int,
+        patched_sizes: dict[str, int],
+    ):
+        pending = [
+            info
+            for _, info in PatchProcesser.plan_reads(infolist)
+            if not PatchProcesser._skip_patched(update_file, info, journal)
+        ]
+        if workers > 1 and len(pending) > 1:
+            PatchProcesser._patch_files_parallel(
+                patch_to,
+                update_file,
+                pending,
+                temp_dir,
+                hpatchzexe,
+                journal,
+                workers,
+                budget,
+                patched_sizes,
             )
-            # patched = hdiff.parent / Path(info.filename).stem
-            hdiff = Path(update_file.extract(info, temp_dir))
-            old = (patch_to / info.filename).with_suffix("")
-            new = hdiff.with_suffix("")
-            LOGGER.debug(
-                "Patching to new file %s using old file %s and hdiff file %s",
-                new,
-                old,
-                hdiff,
+            return
+        for info in pending:
+            PatchProcesser._patch_file(
+                patch_to,
+                update_file,
+                info,
+                temp_dir,
+                hpatchzexe,
+                journal,
+                patched_sizes.get(info.filename),
             )
-            ret_new = BruhHPatchZ(
-                old,
-                hdiff,
-                new,
-                lambda _, step, info=info: update_file.progress_callback(info, step),
+
+    @staticmethod
+    def _patch_files_parallel(
+        patch_to: Path,
+        update_file: BruhZipFile,
+        infolist: list[ZipInfo],
+        temp_dir: Path,
+        hpatchzexe: Path,
+        journal: Optional[PatchJournal],
+        workers: int,
+        budget: int,
+        patched_sizes: dict[str, int],
+    ):
+        space = SpaceBudget(budget)
+        slots = Semaphore(workers)
+        failures: list[BaseException] = []
+        LOGGER.debug(
+            "Patching %d hdiff files with %d hpatchz workers in %d bytes of temporary space",
+            len(infolist),
+            workers,
+            budget,
+        )
+
+        def patch(info: ZipInfo):
+            PatchProcesser._patch_file(
+                patch_to,
+                get_handle(),
+                info,
+                temp_dir,
                 hpatchzexe,
-            ).patch()
-            LOGGER.debug(
-                "Moving patched file %s to replace old file %s",
-                ret_new,
-                old,
+                journal,
+                patched_sizes.get(info.filename),
             )
-            BruhCopy(
-                lambda _, step, info=info: update_file.progress_callback(info, step)
-            ).bruh_move(ret_new, old, hdiff, True)
+
+        def finished(future: Future, cost: int):
+            space.release(cost)
+            slots.release()
+            if not future.cancelled() and future.exception() is not None:
+                failures.append(future.exception())  # type: ignore
+
+        with PatchProcesser._worker_handles(
+            update_file
+        ) as get_handle, ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="HPatchZ"
+        ) as executor:
+            for info in infolist:
+                # the extracted hdiff file and the new file hpatchz writes next to it, about as big as the old one without a manifest
+                old = (patch_to / info.filename).with_suffix("")
+                cost = info.file_size + patched_sizes.get(
+                    info.filename, old.stat().st_size if old.exists() else 0
+                )
+                # admitted in order, so a big file waits for the running ones to finish instead of being overtaken by small ones forever
+                slots.acquire()
+                space.acquire(cost)
+                if failures:
+                    space.release(cost)
+                    slots.release()
+                    break
+                executor.submit(patch, info).add_done_callback(
+                    lambda future, cost=cost: finished(future, cost)
+                )
+        if failures:
+            raise failures[0]
+
+    @staticmethod
+    def _skip_patched(
+        update_file: BruhZipFile, info: ZipInfo, journal: Optional[PatchJournal] = None
+    ):
+        if journal is None or not journal.is_done(
+            PatchJournal.STEP_PATCH, info.filename
+        ):
+            return False
+        LOGGER.trace("Journal skipping patched file %s", info.filename)
+        update_file.progress_callback(info, info.file_size)
+        return True
+
+    @staticmethod
+    def _patch_file(
+        patch_to: Path,
+        update_file: BruhZipFile,
+        info: ZipInfo,
+        temp_dir: Path,
+        hpatchzexe: Path,
+        journal: Optional[PatchJournal] = None,
+        patched_size: Optional[int] = None,
+    ):
+        LOGGER.debug(
+            "Extracting hdiff patch file %s to %s",
+            info.filename,
+            temp_dir / info.filename,
+        )
+        # patched = hdiff.parent / Path(info.filename).stem
+        hdiff = Path(update_file.extract(info, temp_dir))
+        old = (patch_to / info.filename).with_suffix("")
+        new = hdiff.with_suffix("")
+        LOGGER.debug(
+            "Patching to new file %s using old file %s and hdiff file %s",
+            new,
+            old,
+            hdiff,
+        )
+        ret_new = BruhHPatchZ(
+            old,
+            hdiff,
+            new,
+            lambda _, step: update_file.progress_callback(info, step),
+            hpatchzexe,
+            patched_size,
+        ).patch()
+        verifier = update_file.write_verifier
+        name = Path(info.filename).with_suffix("").as_posix()
+        hasher = md5hasher() if verifier is not None and verifier.wants(name) else None
+        LOGGER.debug(
+            "Committing patched file %s to replace old file %s",
+            ret_new,
+            old,
+        )
+        copier = BruhCopy(lambda _, step: update_file.progress_callback(info, step))
+        copier.bruh_commit(ret_new, old, hdiff, True, hasher)
+        if hasher is not None:
+            if copier.hashed:
+                verifier.check(name, hasher.hexdigest())  # type: ignore
+            else:
+                # copied by the kernel, the verify step reads it back
+                verifier.forget(name)  # type: ignore
+        if journal is not None:
+            # the old file is gone now, patching it again would fail
+            journal.record(PatchJournal.STEP_PATCH, info.filename)
 
     @staticmethod
     def step_verify_files(
         verify_in: Path,
         lang: GameLanguage,
-        raw_pkg_version_of_update_file: bytes,
-        entries: Collection[Entry_pkg_version],
+        pkg_version: CompactManifest,
         progress: Progress,
         taskid: TaskID,
+        journal: Optional[PatchJournal] = None,
+        md5_cache: Optional[Md5Cache] = None,
+        workers: int = 1,
+        write_verifier: Optional[WriteVerifier] = None,
     ):
         LOGGER.notice(
             "Patching %s step %d: Verify inpkg files of language %s in %s",
@@ -243,19 +671,130 @@ class PatchProcesser:
             "Verifying pkg_version file %s",
             pkg_version_file,
         )
-        if pkg_version_file.read_bytes() != raw_pkg_version_of_update_file:
+        raw = pkg_version_file.read_bytes()
+        if (
+            len(raw) != pkg_version.raw_size
+            or md5hasher(raw).digest() != pkg_version.raw_md5
+        ):
             raise AssertionError(
                 f"The pkg_version {pkg_version_file} isn't the same file from the update file."
             )
-        progress.advance(taskid, len(raw_pkg_version_of_update_file))
-        for entry in entries:
-            PatchProcesser._verify_file(
-                verify_in / entry.remoteName,
-                entry.md5,
-                entry.fileSize,
-                progress,
-                taskid,
+        progress.advance(taskid, pkg_version.raw_size)
+        pending: list[Entry_pkg_version] = []
+        verified_on_write = 0
+        for entry in pkg_version:
+            if journal is not None and journal.is_done(
+                PatchJournal.STEP_VERIFY, entry.remoteName.as_posix()
+            ):
+                progress.advance(taskid, entry.fileSize)
+                continue
+            if write_verifier is not None and write_verifier.is_verified(
+                verify_in, entry
+            ):
+                LOGGER.trace("Verified while written %s", entry.remoteName)
+                progress.advance(taskid, entry.fileSize)
+                PatchProcesser._record_verified(verify_in, entry, journal, md5_cache)
+                verified_on_write += entry.fileSize
+                continue
+            pending.append(entry)
+        if verified_on_write:
+            LOGGER.info(
+                "Verified %d bytes while writing them, reading back %d files",
+                verified_on_write,
+                len(pending),
             )
+        failures = PatchProcesser._verify_files(
+            verify_in, pending, progress, taskid, journal, md5_cache, workers
+        )
+        if journal is not None:
+            journal.sync()
+        if failures:
+            for failure in failures:
+                LOGGER.warning("%s", failure)
+            raise ExceptionGroup(
+                f"{len(failures)} of {len(pending)} files in {verify_in} failed verification",
+                failures,
+            )
+
+    @staticmethod
+    def _verify_files(
+        verify_in: Path,
+        entries: list[Entry_pkg_version],
+        progress: Progress,
+        taskid: TaskID,
+        journal: Optional[PatchJournal],
+        md5_cache: Optional[Md5Cache],
+        workers: int,
+    ):
+        # every file is checked, the failures are returned together instead of stopping at the first
+        failures: list[FileIntegrityError] = []
+
+        def verify(entry: Entry_pkg_version):
+            file = verify_in / entry.remoteName
+            try:
+                PatchProcesser._verify_file(
+                    file, entry.md5, entry.fileSize, progress, taskid
+                )
+            except FileIntegrityError as e:
+                return e
+            PatchProcesser._record_verified(verify_in, entry, journal, md5_cache)
+            return None
+
+        if workers <= 1 or len(entries) <= 1:
+            for entry in entries:
+                if failure := verify(entry):
+                    failures.append(failure)
+            return failures
+        LOGGER.debug(
+            "Verifying %d files in %s with %d workers",
+            len(entries),
+            verify_in,
+            workers,
+        )
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="Verify"
+        ) as executor:
+            for failure in executor.map(
+                verify, PatchProcesser.plan_verify(verify_in, entries)
+            ):
+                if failure:
+                    failures.append(failure)
+        return failures
+
+    @staticmethod
+    def _record_verified(
+        verify_in: Path,
+        entry: Entry_pkg_version,
+        journal: Optional[PatchJournal],
+        md5_cache: Optional[Md5Cache],
+    ):
+        if journal is not None:
+            journal.record(PatchJournal.STEP_VERIFY, entry.remoteName.as_posix())
+        if md5_cache is not None:
+            # the next incremental run trusts the verified md5 without hashing again
+            md5_cache.put(verify_in / entry.remoteName, entry.md5)
+
+    @staticmethod
+    def plan_verify(verify_in: Path, entries: list[Entry_pkg_version]):
+        # the biggest files first, taking turns between the disks the game is spread over
+        by_device: dict[int, list[Entry_pkg_version]] = {}
+        for entry in entries:
+            try:
+                device = (verify_in / entry.remoteName).stat().st_dev
+            except OSError:
+                # reported as missing when it is verified
+                device = -1
+            by_device.setdefault(device, []).append(entry)
+        queues = [
+            sorted(queue, key=lambda entry: entry.fileSize, reverse=True)
+            for queue in by_device.values()
+        ]
+        return [
+            entry
+            for turn in zip_longest(*queues)
+            for entry in turn
+            if entry is not None
+        ]
 
     @staticmethod
     def _verify_file(
@@ -271,26 +810,25 @@ class PatchProcesser:
             expectedsize,
             md5,
         )
-        filesize = file.stat().st_size
+        try:
+            filesize = file.stat().st_size
+        except FileNotFoundError:
+            raise FileIntegrityError(file, expectedsize, None, md5, None) from None
         if filesize != expectedsize:
-            raise AssertionError(
-                f"The {file} size {filesize} isn't expected {expectedsize}."
-            )
-        bfsize = BruhCopy.COPY_BUFSIZE
+            raise FileIntegrityError(file, expectedsize, filesize, md5, None)
+        bfsize = PatchProcesser.VERIFY_BUFSIZE
         hasher = md5hasher()
-        with memoryview(bytearray(bfsize)) as mv, file.open("rb") as f:
+        with memoryview(bytearray(bfsize)) as mv, file.open("rb", buffering=0) as f:
+            PlatformIO.advise_sequential(f.fileno())
+            # a raw read can come back short before the end, on network shares or after a signal
             while b := f.readinto(mv):
-                if b < bfsize:
-                    with mv[:b] as smv:
-                        hasher.update(smv)
-                        progress.advance(taskid, b)
-                    break
-                else:
-                    hasher.update(mv)
-                    progress.advance(taskid, b)
+                RATE_LIMITS.consume(IOClass.PATCH_IO, b)
+                with mv[:b] as smv:
+                    hasher.update(smv)
+                progress.advance(taskid, b)
         hashed = hasher.hexdigest()
         if hashed != md5:
-            raise AssertionError(f"The file {file} hash {hashed} isn't expected {md5}.")
+            raise FileIntegrityError(file, expectedsize, filesize, md5, hashed)
 
     @staticmethod
     def step_write_config_ini(
@@ -308,13 +846,14 @@ class PatchProcesser:
 
 
 class FileIntegrityError(Exception):
+    # the actual size or md5 is None when the file couldn't be read that far
     def __init__(
         self,
         file: Path,
         expected_size: int,
-        actual_size: int,
+        actual_size: Optional[int],
         expected_md5: str,
-        actual_md5: str,
+        actual_md5: Optional[str],
         *args: object,
     ) -> None:
         self.file = file
@@ -323,3 +862,10 @@ class FileIntegrityError(Exception):
         self.expected_md5 = expected_md5
         self.actual_md5 = actual_md5
         super().__init__(*args)
+
+    def __str__(self):
+        if self.actual_size is None:
+            return f"The file {self.file} is missing."
+        if self.actual_md5 is None:
+            return f"The {self.file} size {self.actual_size} isn't expected {self.expected_size}."
+        return f"The file {self.file} hash {self.actual_md5} isn't expected {self.expected_md5}."
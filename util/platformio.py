@@ -0,0 +1,175 @@
+import mmap
+import os
+from errno import EINVAL, ENOSYS, ENOTSOCK, EOPNOTSUPP, EXDEV
+from typing import BinaryIO, Optional
+
+from util.logger import LOGGER
+
+WINDOWS = os.name == "nt"
+if WINDOWS:
+    from msvcrt import get_osfhandle
+
+    from ntsecuritycon import FILE_READ_ATTRIBUTES, FILE_WRITE_ATTRIBUTES
+    from pywintypes import TimeStamp
+    from win32file import (
+        FILE_ATTRIBUTE_NORMAL,
+        FILE_SHARE_DELETE,
+        FILE_SHARE_READ,
+        FILE_SHARE_WRITE,
+        OPEN_EXISTING,
+        CreateFile,
+        DeviceIoControl,
+        FileAllocationInfo,
+        GetFileTime,
+        SetFileInformationByHandle,
+        SetFileTime,
+    )
+    from winioctlcon import FSCTL_SET_SPARSE
+else:
+    import ctypes
+    import ctypes.util
+    from fcntl import ioctl
+
+    _LIBC = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    _FALLOCATE = getattr(_LIBC, "fallocate", None)
+    if _FALLOCATE is not None:
+        _FALLOCATE.argtypes = (
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.c_int64,
+            ctypes.c_int64,
+        )
+
+
+# errors of a zero copy call that the filesystem or platform doesn't support
+ZERO_COPY_UNSUPPORTED = (EINVAL, ENOSYS, ENOTSOCK, EOPNOTSUPP, EXDEV)
+
+
+class PlatformIO:
+    # linux/falloc.h, reserves the blocks but leaves the file size alone
+    FALLOC_FL_KEEP_SIZE = 0x01
+    # linux/fs.h, clones the extents of a file on btrfs, xfs and other CoW filesystems
+    FICLONE = 0x40049409
+    # 100ns FILETIME ticks between 1601-01-01 and the unix epoch
+    FILETIME_EPOCH = 116444736000000000
+
+    @staticmethod
+    def preallocate(f: BinaryIO, size: int):
+        # the file size must stay as it is, a resumed download appends at its end
+        if WINDOWS:
+            SetFileInformationByHandle(
+                get_osfhandle(f.fileno()), FileAllocationInfo, size
+            )
+        elif _FALLOCATE is not None:
+            if _FALLOCATE(f.fileno(), PlatformIO.FALLOC_FL_KEEP_SIZE, 0, size):
+                # tmpfs, network shares and others don't support it, writing still works
+                LOGGER.trace(
+                    "Can't preallocate %s size %d: %s",
+                    f.name,
+                    size,
+                    os.strerror(ctypes.get_errno()),
+                )
+
+    @staticmethod
+    def reflink(src: BinaryIO, dst: BinaryIO):
+        # dst shares the blocks of src until either is written, nothing is copied
+        if WINDOWS:
+            return False
+        try:
+            ioctl(dst.fileno(), PlatformIO.FICLONE, src.fileno())
+            return True
+        except OSError as e:
+            LOGGER.trace("Can't reflink %s to %s: %s", src.name, dst.name, e)
+            return False
+
+    @staticmethod
+    def make_sparse(f: BinaryIO):
+        # posix files are sparse as long as the holes are never written
+        if WINDOWS:
+            DeviceIoControl(get_osfhandle(f.fileno()), FSCTL_SET_SPARSE, None, None)
+
+    @staticmethod
+    def advise_sequential(fd: int):
+        # the kernel reads further ahead, windows only takes a hint when the file is opened
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    @staticmethod
+    def advise_sequential_map(mm: mmap.mmap):
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+
+    @staticmethod
+    def filetime_to_ns(filetime: int):
+        return (filetime - PlatformIO.FILETIME_EPOCH) * 100
+
+    @staticmethod
+    def ns_to_filetime(ns: int):
+        return ns // 100 + PlatformIO.FILETIME_EPOCH
+
+    @staticmethod
+    def set_timestamps(
+        path: str, atime_ns: int, mtime_ns: int, ctime_ns: Optional[int] = None
+    ):
+        # only windows keeps a creation time that can be written
+        if WINDOWS and ctime_ns is not None:
+            handle = CreateFile(
+                path,
+                FILE_WRITE_ATTRIBUTES,
+                FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE,
+                None,
+                OPEN_EXISTING,
+                FILE_ATTRIBUTE_NORMAL,
+                None,
+            )
+            SetFileTime(
+                handle,
+                TimeStamp(PlatformIO.ns_to_filetime(ctime_ns)),  # type: ignore
+                TimeStamp(PlatformIO.ns_to_filetime(atime_ns)),  # type: ignore
+                TimeStamp(PlatformIO.ns_to_filetime(mtime_ns)),  # type: ignore
+            )
+            handle.close()
+            return
+        os.utime(path, ns=(atime_ns, mtime_ns))
+
+    @staticmethod
+    def copy_timestamps(src: str, dst: str):
+        if WINDOWS:
+            src_handle = CreateFile(
+                src,
+                FILE_READ_ATTRIBUTES,
+                FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE,
+                None,
+                OPEN_EXISTING,
+                FILE_ATTRIBUTE_NORMAL,
+                None,
+            )
+            src_time = GetFileTime(src_handle)  # type: ignore
+            src_handle.close()
+            LOGGER.trace(
+                "Rewriting timestamp %s from file %s to file %s",
+                src_time,
+                src,
+                dst,
+            )
+            dst_handle = CreateFile(
+                dst,
+                FILE_WRITE_ATTRIBUTES,
+                FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE,
+                None,
+                OPEN_EXISTING,
+                FILE_ATTRIBUTE_NORMAL,
+                None,
+            )
+            SetFileTime(dst_handle, *src_time)  # type: ignore
+            dst_handle.close()
+            return
+        stat = os.stat(src)
+        LOGGER.trace(
+            "Rewriting timestamp %d %d from file %s to file %s",
+            stat.st_atime_ns,
+            stat.st_mtime_ns,
+            src,
+            dst,
+        )
+        os.utime(dst, ns=(stat.st_atime_ns, stat.st_mtime_ns))
@@ -0,0 +1,119 @@
+from enum import Enum
+from pathlib import Path
+from threading import Lock
+from time import monotonic, sleep
+from typing import Mapping, Optional
+
+from util.logger import LOGGER
+
+
+class TokenBucket:
+    # how many seconds worth of tokens can be saved up while idle
+    BURST_SECONDS = 0.5
+
+    def __init__(self, rate: int):
+        # bytes per second, 0 means unlimited
+        self.rate = rate
+        self._tokens = 0.0
+        self._last = monotonic()
+        self._lock = Lock()
+
+    def set_rate(self, rate: int):
+        with self._lock:
+            self.rate = rate
+            self._tokens = 0.0
+            self._last = monotonic()
+
+    def consume(self, amount: int):
+        if delay := self.reserve(amount):
+            sleep(delay)
+
+    def reserve(self, amount: int) -> float:
+        # returns how long the caller has to wait, an event loop can await it instead of sleeping
+        if not self.rate:
+            return 0
+        with self._lock:
+            rate = self.rate
+            now = monotonic()
+            self._tokens = min(
+                self._tokens + (now - self._last) * rate,
+                rate * self.BURST_SECONDS,
+            )
+            self._last = now
+            # the debt is paid by waiting outside of the lock, so other consumers queue up behind it
+            self._tokens -= amount
+            deficit = -self._tokens
+        return deficit / rate if deficit > 0 else 0
+
+
+class IOClass(Enum):
+    # bytes received from the CDN
+    NETWORK = "network"
+    # bytes of downloaded archives written to patch_path
+    ARCHIVE_WRITE = "archivewrite"
+    # bytes extracted, copied and verified by the patch step
+    PATCH_IO = "patchio"
+
+
+class RateLimits:
+    # how often the control file is checked for changes while running
+    RELOAD_INTERVAL = 1
+
+    def __init__(self):
+        self.buckets = {ioclass: TokenBucket(0) for ioclass in IOClass}
+        self.control_file: Optional[Path] = None
+        self._control_mtime: Optional[int] = None
+        self._next_reload = 0.0
+        self._reload_lock = Lock()
+
+    def configure(self, rates: Mapping[IOClass, int], control_file: Optional[Path]):
+        for ioclass, rate in rates.items():
+            self.set_rate(ioclass, rate)
+        self.control_file = control_file
+        self._reload()
+
+    def set_rate(self, ioclass: IOClass, rate: int):
+        if self.buckets[ioclass].rate != rate:
+            LOGGER.info("Rate limit of %s set to %d bytes/s", ioclass.value, rate)
+            self.buckets[ioclass].set_rate(rate)
+
+    def consume(self, ioclass: IOClass, amount: int):
+        if delay := self.reserve(ioclass, amount):
+            sleep(delay)
+
+    def reserve(self, ioclass: IOClass, amount: int):
+        if self.control_file is not None and monotonic() >= self._next_reload:
+            self._reload()
+        return self.buckets[ioclass].reserve(amount)
+
+    def _reload(self):
+        # only one of the consumers has to look at the file
+        if self.control_file is None or not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_reload = monotonic() + self.RELOAD_INTERVAL
+            try:
+                mtime = self.control_file.stat().st_mtime_ns
+            except FileNotFoundError:
+                return
+            if mtime == self._control_mtime:
+                return
+            self._control_mtime = mtime
+            LOGGER.debug("Reloading rate limits from %s", self.control_file)
+            for line in self.control_file.read_text().splitlines():
+                # lines like "network=10240" in KiB/s, same as the config arguments
+                if not line.strip() or line.startswith("#"):
+                    continue
+                name, _, value = line.partition("=")
+                try:
+                    self.set_rate(IOClass(name.strip()), int(value) * 1024)
+                except ValueError:
+                    LOGGER.warning(
+                        "Ignoring rate limit line %r in %s", line, self.control_file
+                    )
+        finally:
+            self._reload_lock.release()
+
+
+# shared by the downloader and the patcher, so one file controls the whole run
+RATE_LIMITS = RateLimits()
@@ -0,0 +1,71 @@
+from io import SEEK_CUR, SEEK_END, SEEK_SET, RawIOBase
+
+from httpx import Client, HTTPError
+from retry import retry
+from util.logger import LOGGER
+
+
+class RemoteFile(RawIOBase):
+    # zipfile reads the end of central directory in a few tiny reads, fetch a bit more each time
+    READAHEAD = 64 * 1024
+
+    def __init__(self, client: Client, link: str, size: int):
+        self.client = client
+        self.link = link
+        self.size = size
+        self.fetched_bytes = 0
+        self._position = 0
+        self._block_start = 0
+        self._block = b""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset: int, whence: int = SEEK_SET):
+        if whence == SEEK_SET:
+            self._position = offset
+        elif whence == SEEK_CUR:
+            self._position += offset
+        elif whence == SEEK_END:
+            self._position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        if self._position < 0:
+            raise OSError(f"Negative seek position {self._position}")
+        return self._position
+
+    def readinto(self, buffer):
+        with memoryview(buffer) as mv:
+            wanted = min(len(mv), self.size - self._position)
+            if wanted <= 0:
+                return 0
+            offset = self._position - self._block_start
+            if offset < 0 or offset + wanted > len(self._block):
+                self._block_start = self._position
+                self._block = self._fetch(
+                    self._position,
+                    min(self._position + max(wanted, self.READAHEAD), self.size),
+                )
+                offset = 0
+            mv[:wanted] = self._block[offset : offset + wanted]
+        self._position += wanted
+        return wanted
+
+    @retry(HTTPError, delay=2, backoff=2, max_delay=60, logger=LOGGER)
+    def _fetch(self, start: int, end: int):
+        LOGGER.trace("Fetching range %d-%d of %s", start, end, self.link)
+        response = self.client.get(
+            self.link, headers={"Range": f"bytes={start}-{end - 1}"}
+        )
+        response.raise_for_status()
+        assert (
+            response.status_code == 206 and len(response.content) == end - start
+        ), f"{response.status_code=} fetched {len(response.content)} != {end=} - {start=}"
+        self.fetched_bytes += end - start
+        return response.content
@@ -0,0 +1,32 @@
+from threading import Condition
+
+from util.logger import LOGGER
+
+
+class SpaceBudget:
+    # bytes of temporary files that may exist at once, a job bigger than all of it runs alone
+    def __init__(self, budget: int):
+        # 0 doesn't limit, like the rate limits
+        self.budget = budget
+        self.used = 0
+        self._condition = Condition()
+
+    def fits(self, cost: int):
+        return not self.budget or not self.used or self.used + cost <= self.budget
+
+    def acquire(self, cost: int):
+        with self._condition:
+            if not self.fits(cost):
+                LOGGER.trace(
+                    "Waiting for %d bytes of temporary space, %d of %d used",
+                    cost,
+                    self.used,
+                    self.budget,
+                )
+                self._condition.wait_for(lambda: self.fits(cost))
+            self.used += cost
+
+    def release(self, cost: int):
+        with self._condition:
+            self.used -= cost
+            self._condition.notify_all()
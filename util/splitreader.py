@@ -0,0 +1,121 @@
+import os
+from bisect import bisect_right
+from io import SEEK_CUR, SEEK_END, SEEK_SET, RawIOBase
+from itertools import accumulate
+from mmap import ACCESS_READ, mmap
+from pathlib import Path
+from threading import Lock
+from typing import Optional, Sequence
+
+from util.platformio import PlatformIO
+
+# windows has no positional reads, the parts are mapped there instead
+PREAD = hasattr(os, "pread")
+
+
+class SplitReader(RawIOBase):
+    # the parts of a split archive as one file, read without a shared file position
+    def __init__(self, files: Sequence[Path], sequential: bool = False):
+        self.files = list(files)
+        self.sequential = sequential
+        self._fds: list[int] = []
+        try:
+            for file in self.files:
+                self._fds.append(
+                    os.open(file, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+                )
+                if sequential:
+                    PlatformIO.advise_sequential(self._fds[-1])
+        except OSError:
+            self.close()
+            raise
+        # only the sizes are read on opening, zipfile seeks to the end straight away
+        self.sizes = [os.fstat(fd).st_size for fd in self._fds]
+        self.starts = list(accumulate(self.sizes, initial=0))
+        self.size = self.starts[-1]
+        self._maps: list[Optional[mmap]] = [None] * len(self._fds)
+        self._maps_lock = Lock()
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset: int, whence: int = SEEK_SET):
+        if whence == SEEK_SET:
+            self._position = offset
+        elif whence == SEEK_CUR:
+            self._position += offset
+        elif whence == SEEK_END:
+            self._position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        if self._position < 0:
+            raise OSError(f"Negative seek position {self._position}")
+        return self._position
+
+    def readinto(self, buffer):
+        read = self.preadinto(buffer, self._position)
+        self._position += read
+        return read
+
+    def spans(self, offset: int, length: int):
+        # (part, offset in the part, length) of a range, cut short at the end of the last part
+        part = bisect_right(self.starts, offset) - 1
+        while length > 0 and part < len(self._fds):
+            start = offset - self.starts[part]
+            n = min(length, self.sizes[part] - start)
+            if n > 0:
+                yield part, start, n
+                offset += n
+                length -= n
+            part += 1
+
+    def preadinto(self, buffer, offset: int):
+        # safe from any number of threads, nothing but the position of readinto is shared
+        done = 0
+        with memoryview(buffer) as mv:
+            for part, start, n in self.spans(offset, len(mv)):
+                if PREAD:
+                    data = os.pread(self._fds[part], n, start)
+                else:
+                    data = self.map(part)[start : start + n]  # type: ignore
+                mv[done : done + len(data)] = data
+                done += len(data)
+                if len(data) < n:
+                    # the part got shorter since it was opened
+                    break
+        return done
+
+    def pread(self, size: int, offset: int):
+        buffer = bytearray(max(0, min(size, self.size - offset)))
+        return bytes(buffer[: self.preadinto(buffer, offset)])
+
+    def fileno_of(self, part: int):
+        return self._fds[part]
+
+    def map(self, part: int) -> Optional[mmap]:
+        # an empty part can't be mapped
+        if self._maps[part] is None and self.sizes[part]:
+            with self._maps_lock:
+                if self._maps[part] is None:
+                    mm = mmap(self._fds[part], 0, access=ACCESS_READ)
+                    if self.sequential:
+                        PlatformIO.advise_sequential_map(mm)
+                    self._maps[part] = mm
+        return self._maps[part]
+
+    def close(self):
+        if self.closed:
+            return
+        for mm in getattr(self, "_maps", ()):
+            if mm is not None:
+                mm.close()
+        for fd in getattr(self, "_fds", ()):
+            os.close(fd)
+        super().close()
@@ -0,0 +1,48 @@
+from pathlib import Path
+from threading import Lock
+
+from game.gameutil import CompactManifest, Entry_pkg_version
+from util.logger import LOGGER
+
+
+class WriteVerifier:
+    # md5 of the pkg_version files taken while they are written, the verify step doesn't read them back
+    def __init__(self, pkg_version: CompactManifest):
+        self.pkg_version = pkg_version
+        self._lock = Lock()
+        # only the last write of a file counts, an extracted file can be patched afterwards
+        self._verified: set[str] = set()
+
+    def wants(self, name: str):
+        return self.pkg_version.index(name) >= 0
+
+    def check(self, name: str, md5: str):
+        i = self.pkg_version.index(name)
+        matched = i >= 0 and self.pkg_version.entry(i).md5 == md5
+        with self._lock:
+            if matched:
+                self._verified.add(name)
+            else:
+                self._verified.discard(name)
+        if not matched:
+            LOGGER.debug(
+                "Written file %s md5 %s isn't the one in pkg_version, it is read back when verifying",
+                name,
+                md5,
+            )
+        return matched
+
+    def forget(self, name: str):
+        with self._lock:
+            self._verified.discard(name)
+
+    def is_verified(self, verify_in: Path, entry: Entry_pkg_version):
+        name = entry.remoteName.as_posix()
+        with self._lock:
+            if name not in self._verified:
+                return False
+        # the size is cheap to check, in case something touched the file since
+        try:
+            return (verify_in / entry.remoteName).stat().st_size == entry.fileSize
+        except FileNotFoundError:
+            return False
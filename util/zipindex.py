@@ -0,0 +1,105 @@
+import pickle
+from pathlib import Path
+from typing import Any, Optional
+from zipfile import ZipFile, ZipInfo
+
+from util.logger import LOGGER
+
+
+class ZipIndex:
+    # bump when the pickled layout changes, older indexes are then parsed again
+    FORMAT = 2
+
+    def __init__(
+        self,
+        fingerprint: tuple[tuple[str, int, int], ...],
+        key: str,
+        infolist: list[ZipInfo],
+        start_dir: int,
+        comment: bytes,
+        data: dict[str, Any],
+    ):
+        self.fingerprint = fingerprint
+        # what else the data depends on, like the language of an update archive
+        self.key = key
+        self.infolist = infolist
+        self.start_dir = start_dir
+        self.comment = comment
+        # parsed by the owner of the archive, pickled together so it refers to the same ZipInfos
+        self.data = data
+
+    @staticmethod
+    def index_file(file: Path | list[Path]):
+        first = file[0] if isinstance(file, list) else file
+        return first.with_name(f"{first.name}.index")
+
+    @staticmethod
+    def get_fingerprint(file: Path | list[Path]):
+        # a changed part of a split archive changes its size or mtime
+        return tuple(
+            (part.name, stat.st_size, stat.st_mtime_ns)
+            for part in (file if isinstance(file, list) else [file])
+            for stat in (part.stat(),)
+        )
+
+    @classmethod
+    def from_zipfile(
+        cls, zf: ZipFile, file: Path | list[Path], key: str, data: dict[str, Any]
+    ):
+        return cls(
+            cls.get_fingerprint(file),
+            key,
+            zf.infolist(),
+            zf.start_dir,
+            zf.comment,
+            data,
+        )
+
+    @classmethod
+    def load(cls, file: Path | list[Path], key: str) -> Optional["ZipIndex"]:
+        index_file = cls.index_file(file)
+        fingerprint = cls.get_fingerprint(file)
+        try:
+            with index_file.open("rb") as f:
+                form, index = pickle.load(f)
+            stale = (
+                form != cls.FORMAT
+                or index.key != key
+                or index.fingerprint != fingerprint
+            )
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # only a cache, an index of an older layout or a renamed module is read again from the archive
+            LOGGER.warning("Ignoring broken archive index %s: %r", index_file, e)
+            return None
+        if stale:
+            LOGGER.debug("Archive index %s is stale", index_file)
+            return None
+        LOGGER.debug(
+            "Loaded archive index %s with %d members", index_file, len(index.infolist)
+        )
+        return index
+
+    def save(self, file: Path | list[Path]):
+        index_file = self.index_file(file)
+        temp = index_file.with_name(f"{index_file.name}.tmp")
+        try:
+            with temp.open("wb") as f:
+                pickle.dump((self.FORMAT, self), f, pickle.HIGHEST_PROTOCOL)
+            temp.replace(index_file)
+        except OSError as e:
+            # only a later run gets slower
+            LOGGER.warning("Can't save archive index %s: %s", index_file, e)
+            return
+        LOGGER.debug(
+            "Saved archive index %s with %d members", index_file, len(self.infolist)
+        )
+
+    def fill(self, zf: ZipFile):
+        # stands in for ZipFile._RealGetContents
+        zf.start_dir = self.start_dir  # type: ignore
+        zf._comment = self.comment  # type: ignore
+        for info in self.infolist:
+            zf.filelist.append(info)
+            zf.NameToInfo[info.filename] = info